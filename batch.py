@@ -0,0 +1,406 @@
+"""
+Batch shrinking: scan directories recursively and shrink every video and image
+on a process pool, keeping the machine busy without oversubscribing it.
+
+  python batch.py [DIR ...] [--threads 4] [--jobs N] [--retry-failed]
+
+Videos are written next to the source as <name>_shrunk.mp4 (like shrink.py),
+images into an `output` folder next to the source (like the GUI). Per-file logs
+(plus a .jsonl of structured progress events per video) go to shrink_logs/, and
+shrink_logs/manifest.sqlite remembers what was done so re-runs skip unchanged
+inputs and resume after a crash or Ctrl-C.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import os
+import re
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import image_shrinker
+import resources
+import shrink
+from manifest import Manifest
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+LOG_DIR = SCRIPT_DIR / "shrink_logs"
+MANIFEST_PATH = LOG_DIR / "manifest.sqlite"
+
+VIDEO_EXTS = {
+    ".mp4", ".mov", ".avi", ".mkv", ".wmv", ".flv", ".webm", ".m4v", ".mpg", ".mpeg", ".3gp", ".3g2",
+    ".ts", ".mts", ".m2ts", ".vob", ".ogv", ".rm", ".rmvb", ".asf", ".divx",
+}
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+
+# Our own output/log folders and VCS internals are never scanned
+SKIP_DIRS = {"output", "shrink_logs", "__pycache__", ".git"}
+
+
+def skip_dir(name: str) -> bool:
+    # Also skip the hidden per-job scratch folders shrink.py makes (.stem__scratch_*)
+    return name in SKIP_DIRS or (name.startswith(".") and "__scratch_" in name)
+
+
+def safe_name(name: str) -> str:
+    # Same mapping as shrink_all.sh: anything outside [A-Za-z0-9._-] becomes "_"
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def video_output(path: Path) -> Path:
+    return path.with_name(path.stem + "_shrunk.mp4")
+
+
+def image_output_dir(path: Path) -> Path:
+    return path.parent / "output"
+
+
+def file_kind(path: Path) -> str | None:
+    """Return "video", "image", or None for files we never shrink (including our own outputs)."""
+    if "_shrunk" in path.stem:
+        return None
+    ext = path.suffix.lower()
+    if ext in VIDEO_EXTS:
+        return "video"
+    if ext in IMAGE_EXTS:
+        return "image"
+    return None
+
+
+def already_done(kind: str, path: Path, size: int, mtime_ns: int, row: dict | None, retry_failed: bool = False) -> bool:
+    """
+    An input with a manifest row is judged by Manifest.needs_work; one without
+    is done only if its output already exists.
+    """
+    if row is not None:
+        return not Manifest.needs_work(row, size, mtime_ns, retry_failed)
+    if kind == "video":
+        return video_output(path).exists()
+    out_dir = image_output_dir(path)
+    return (out_dir / path.name).exists() or (out_dir / (path.stem + ".jpg")).exists()
+
+
+def scan(roots, known: dict | None = None, retry_failed: bool = False) -> list[tuple]:
+    """
+    Walk roots with os.scandir and return (kind, path, size, mtime_ns) for every
+    file to shrink, in one pass. Inputs with a manifest row in `known` are
+    judged by Manifest.needs_work; inputs without one are skipped only if their
+    output already exists. Our own outputs are never picked up.
+    """
+    work = []
+    stack = [Path(r).resolve() for r in roots]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"Cannot scan {folder}: {e}")
+            continue
+
+        names = {e.name for e in entries}
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not skip_dir(entry.name):
+                    stack.append(Path(entry.path))
+                continue
+            if not entry.is_file():
+                continue
+
+            path = Path(entry.path)
+            kind = file_kind(path)
+            if kind is None:
+                continue
+
+            st = entry.stat()
+            row = known.get(str(path)) if known else None
+            if row is None and kind == "video":
+                # The directory listing already tells us; saves a stat per video
+                if video_output(path).name in names:
+                    continue
+            elif already_done(kind, path, st.st_size, st.st_mtime_ns, row, retry_failed):
+                continue
+
+            work.append((kind, path, st.st_size, st.st_mtime_ns))
+
+    work.sort(key=lambda item: str(item[1]))
+    return work
+
+
+def run_job(kind: str, path: str, threads: int, log_dir: str) -> dict:
+    """Worker-process entry point: shrink one file, logging its output to log_dir."""
+    path = Path(path)
+    log = Path(log_dir) / (safe_name(path.name) + ".log")
+    result = {
+        "kind": kind,
+        "path": str(path),
+        "status": "failed",
+        "output": None,
+        "input_size": 0,
+        "output_size": 0,
+        "rung": None,
+        "peak_rss": None,
+        "error": None,
+    }
+
+    start = time.perf_counter()
+    with open(log, "a", encoding="utf-8") as fh, contextlib.redirect_stdout(fh), contextlib.redirect_stderr(fh):
+        print(f"---- {time.ctime()} ----")
+        try:
+            # Inside the try: an input deleted since the scan is a per-file failure
+            result["input_size"] = path.stat().st_size
+            if kind == "video":
+                info = {}
+                out = shrink.process_video(
+                    str(path), str(video_output(path)), threads, info=info,
+                    metrics_path=log.with_suffix(".jsonl"),
+                )
+                result["rung"] = {"strategy": info.get("strategy"), "rung": info.get("rung")}
+            else:
+                # This worker process runs one job at a time, so its peak RSS is the image's
+                with resources.RssSampler() as rss:
+                    out = image_shrinker.shrink_image(str(path), str(image_output_dir(path)))
+                result["peak_rss"] = rss.peak
+                if result["peak_rss"]:
+                    print(f"Peak RSS: {result['peak_rss'] / (1024 * 1024):.0f} MB")
+            result.update(status="done", output=out, output_size=Path(out).stat().st_size)
+        except Exception as e:
+            result["error"] = str(e)
+            print(f"FAILED: {e}")
+
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def failed_result(kind: str, path, error: str, elapsed: float) -> dict:
+    """A run_job-shaped result for a job that never got to report its own."""
+    try:
+        input_size = Path(path).stat().st_size
+    except OSError:
+        input_size = 0
+    return {
+        "kind": kind,
+        "path": str(path),
+        "status": "failed",
+        "output": None,
+        "input_size": input_size,
+        "output_size": 0,
+        "rung": None,
+        "peak_rss": None,
+        "error": error,
+        "elapsed": elapsed,
+    }
+
+
+def job_cost(kind: str, threads: int) -> int:
+    # A video keeps `threads` ffmpeg threads busy; an image encode is single-threaded
+    return threads if kind == "video" else 1
+
+
+def _image_memory(path) -> int:
+    try:
+        return image_shrinker.estimate_memory(path)
+    except Exception:
+        return 0  # unreadable header; the job itself will report the error
+
+
+class JobPool:
+    """
+    Process pool that runs (kind, path, size, mtime_ns) work items so that the
+    sum of job costs never exceeds `cores`. Videos are started first whenever
+    budget allows; images fill the remaining cores, as long as their estimated
+    memory (image_shrinker.estimate_memory) also fits memory_budget (default:
+    resources.default_memory_budget()). With a manifest, each job is marked
+    running when submitted and its result recorded when it finishes.
+
+    The workers stay warm for the life of the pool, so a long-running caller
+    (watch.py) can keep adding work; run_batch() drains a fixed list.
+    """
+
+    def __init__(
+        self,
+        threads: int = 4,
+        cores: int | None = None,
+        log_dir: Path = LOG_DIR,
+        manifest: Manifest | None = None,
+        memory_budget: int | None = None,
+        initializer=None,
+    ):
+        self.cores = cores or resources.available_cpus()
+        self.threads = max(1, min(threads, self.cores))
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = manifest
+        self.memory = resources.MemoryBudget(memory_budget or resources.default_memory_budget())
+        self.budget = self.cores
+        self.videos = deque()
+        self.images = deque()
+        self.running = {}
+        self._initializer = initializer
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.cores, initializer=self._initializer)
+
+    def add(self, item):
+        (self.videos if item[0] == "video" else self.images).append(item)
+
+    def queued(self) -> int:
+        return len(self.videos) + len(self.images)
+
+    def busy(self) -> bool:
+        return bool(self.running or self.videos or self.images)
+
+    def fill(self):
+        """Submit queued jobs while CPU and memory budget allow."""
+        while True:
+            need = 0
+            if self.videos and job_cost("video", self.threads) <= self.budget:
+                kind, path, size, mtime_ns = self.videos.popleft()
+            elif self.images and self.budget >= 1:
+                need = _image_memory(self.images[0][1])
+                if not self.memory.try_acquire(need):
+                    return
+                kind, path, size, mtime_ns = self.images.popleft()
+            else:
+                return
+            if self.manifest is not None:
+                self.manifest.mark_running(str(path), kind, size, mtime_ns)
+            self.budget -= job_cost(kind, self.threads)
+            future = self._pool.submit(run_job, kind, str(path), self.threads, str(self.log_dir))
+            self.running[future] = (kind, path, need, time.perf_counter())
+
+    def wait(self, timeout: float | None = None) -> list[dict]:
+        """
+        Wait up to timeout for running jobs, record the ones that finished,
+        start more queued work, and return the finished jobs' results.
+        A job whose worker died is recorded as failed, and a broken pool is
+        replaced so later work still runs.
+        """
+        results = []
+        broken = False
+        if self.running:
+            done, _ = concurrent.futures.wait(
+                self.running, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                kind, path, need, started = self.running.pop(future)
+                self.budget += job_cost(kind, self.threads)
+                self.memory.release(need)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # run_job catches job errors itself; this is the worker dying (OOM kill, crash)
+                    broken = broken or isinstance(e, concurrent.futures.BrokenExecutor)
+                    result = failed_result(kind, path, f"worker died: {e}", time.perf_counter() - started)
+                results.append(result)
+                if self.manifest is not None:
+                    self.manifest.record(result)
+        if broken:
+            print("A worker process died; restarting the pool")
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+        self.fill()
+        return results
+
+    def drop_queued(self) -> list[tuple]:
+        """Forget work that has not started yet and return it."""
+        dropped = list(self.videos) + list(self.images)
+        self.videos.clear()
+        self.images.clear()
+        return dropped
+
+    def close(self, wait: bool = True):
+        """Shut the workers down; queued work that has not started is dropped."""
+        self.drop_queued()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def run_batch(
+    work,
+    threads: int = 4,
+    cores: int | None = None,
+    log_dir: Path = LOG_DIR,
+    on_result=None,
+    manifest: Manifest | None = None,
+    memory_budget: int | None = None,
+) -> list[dict]:
+    """
+    Run (kind, path, size, mtime_ns) work items on a JobPool and return their
+    results. on_result(result) is called as each job finishes.
+    """
+    jobs = JobPool(threads, cores, log_dir, manifest, memory_budget)
+    for item in work:
+        jobs.add(item)
+
+    results = []
+    try:
+        jobs.fill()
+        while jobs.running:
+            for result in jobs.wait():
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    except KeyboardInterrupt:
+        print("\nInterrupted; waiting for running jobs to stop...")
+        jobs.close()
+        raise
+    jobs.close()
+    return results
+
+
+def print_result(result: dict):
+    if result["status"] == "done":
+        peak = f", peak RSS {result['peak_rss'] / 1e6:.0f} MB" if result.get("peak_rss") else ""
+        print(
+            f"Done ({result['elapsed']:.1f}s, {result['input_size'] / 1e6:.1f} -> "
+            f"{result['output_size'] / 1e6:.1f} MB{peak}): {result['path']}"
+        )
+    else:
+        print(f"FAILED ({result['elapsed']:.1f}s): {result['path']}: {result['error']}")
+
+
+def print_summary(results: list[dict], wall_s: float):
+    done = [r for r in results if r["status"] == "done"]
+    failed = len(results) - len(done)
+    bytes_in = sum(r["input_size"] for r in results)
+    bytes_out = sum(r["output_size"] for r in done)
+
+    print()
+    print(f"Files: {len(results)} ({len(done)} done, {failed} failed) in {wall_s:.1f}s")
+    print(f"Size: {bytes_in / 1e6:.1f} MB in -> {bytes_out / 1e6:.1f} MB out")
+    if wall_s > 0:
+        print(f"Throughput: {len(results) / wall_s:.2f} files/s, {bytes_in / 1e6 / wall_s:.2f} MB/s input")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Shrink every video and image under one or more directories.")
+    ap.add_argument("dirs", nargs="*", default=[str(SCRIPT_DIR)], help="Directories to scan (default: script folder)")
+    ap.add_argument("--threads", type=int, default=4, help="FFmpeg threads per video job (default: 4)")
+    ap.add_argument("--jobs", type=int, help="CPU budget shared by all jobs (default: usable cores)")
+    ap.add_argument("--retry-failed", action="store_true", help="Also retry inputs that failed in an earlier run")
+    ap.add_argument("--manifest", default=str(MANIFEST_PATH), help=f"Manifest database (default: {MANIFEST_PATH})")
+    args = ap.parse_args()
+
+    manifest = Manifest(args.manifest)
+    print(f"Scanning: {', '.join(args.dirs)}")
+    work = scan(args.dirs, known=manifest.load(), retry_failed=args.retry_failed)
+    print(f"Found {len(work)} files to shrink | Logging to: {LOG_DIR}")
+
+    start = time.perf_counter()
+    try:
+        results = run_batch(
+            work, threads=args.threads, cores=args.jobs, on_result=print_result, manifest=manifest,
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        manifest.close()
+    print_summary(results, time.perf_counter() - start)
+    sys.exit(1 if any(r["status"] != "done" for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
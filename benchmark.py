@@ -0,0 +1,396 @@
+"""
+Benchmarks for the shrinking pipeline. Test media is synthesized with ffmpeg's
+lavfi sources and Pillow, so no sample files are needed.
+
+  python benchmark.py chunked [--duration 120] [--cores 1 2 4 8]
+  python benchmark.py images [--count 16] [--size 6000x4000] [--workers N]
+  python benchmark.py suite [-o results.json] [--quick] [--media-dir DIR]
+  python benchmark.py compare OLD.json NEW.json
+  python benchmark.py ratecontrol [--quick] [--media-dir DIR]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import image_engine
+import image_shrinker
+import shrink
+
+# Suite corpus: (name, lavfi source, size, fps, duration, extra video filter).
+# Static bars, synthetic motion, a detailed zoom and heavy noise span easy to hard.
+SUITE_CLIPS = [
+    ("bars_720p30_60s", "smptehdbars", "1280x720", 30, 60, None),
+    ("testsrc_1080p30_120s", "testsrc2", "1920x1080", 30, 120, None),
+    ("testsrc_1080p60_60s", "testsrc2", "1920x1080", 60, 60, None),
+    ("mandelbrot_1080p30_90s", "mandelbrot", "1920x1080", 30, 90, None),
+    ("noise_1080p30_60s", "testsrc2", "1920x1080", 30, 60, "noise=alls=40:allf=t:all_seed=42"),
+    ("testsrc_2160p30_30s", "testsrc2", "3840x2160", 30, 30, None),
+]
+# (name, size, alpha, format)
+SUITE_IMAGES = [
+    ("rgb_6000x4000.png", (6000, 4000), False, "PNG"),
+    ("rgba_4000x3000.png", (4000, 3000), True, "PNG"),
+    ("rgb_8000x6000.jpg", (8000, 6000), False, "JPEG"),
+    ("rgb_2000x1500.jpg", (2000, 1500), False, "JPEG"),
+]
+# --quick: one clip and two images that still exercise the ladder and the resize path
+QUICK_CLIPS = {"testsrc_1080p30_120s"}
+QUICK_IMAGES = {"rgb_6000x4000.png", "rgba_4000x3000.png"}
+
+
+def make_clip(
+    path: Path, duration: int, size: str = "1920x1080", fps: int = 30, source: str = "testsrc2", vf=None,
+):
+    """Render a high-bitrate test clip from a lavfi source, with a tone."""
+    cmd = [
+        "ffmpeg", "-y",
+        # Not every lavfi source takes a duration (mandelbrot doesn't); -t bounds them all
+        "-f", "lavfi", "-t", str(duration), "-i", f"{source}=size={size}:rate={fps}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+    ]
+    if vf:
+        cmd += ["-vf", vf]
+    cmd += [
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "12", "-g", str(fps * 2),
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k",
+        "-shortest",
+        str(path),
+    ]
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def bench_chunked(args):
+    """Wall time for one rung: whole-file 2-pass with N threads vs N chunks with 1 thread each."""
+    codec, preset, fps, audio_kbps, scale_width = shrink.new_ladder()[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "bench_src.mp4"
+        print(f"Generating {args.duration}s test clip...")
+        make_clip(src, args.duration)
+        duration_s = shrink.media_duration(asyncio.run(shrink.probe_media(src)))
+
+        print(f"{'cores':>5}  {'2pass (s)':>10}  {'chunked (s)':>12}  {'speedup':>8}")
+        for cores in args.cores:
+            out = Path(tmp) / f"bench_out_{cores}.mp4"
+
+            t0 = time.perf_counter()
+            passlog = asyncio.run(shrink.encode_2pass(
+                src, out, duration_s, codec, preset, audio_kbps,
+                fps=fps, scale_width=scale_width, threads=cores,
+            ))
+            t_2pass = time.perf_counter() - t0
+            shrink.cleanup_passlog_set(passlog)
+            out.unlink(missing_ok=True)
+
+            t0 = time.perf_counter()
+            asyncio.run(shrink.encode_chunked(
+                src, out, duration_s, codec, preset, audio_kbps,
+                fps=fps, scale_width=scale_width, threads=1, chunks=cores,
+            ))
+            t_chunked = time.perf_counter() - t0
+            out.unlink(missing_ok=True)
+
+            print(f"{cores:>5}  {t_2pass:>10.1f}  {t_chunked:>12.1f}  {t_2pass / t_chunked:>7.2f}x")
+
+
+def make_image(path: Path, size: tuple[int, int], seed: int, alpha: bool = False, format: str = "PNG"):
+    """
+    Write a large, poorly compressible image: a gradient overlaid with seeded
+    noise (so runs are reproducible), optionally with a gradient alpha channel.
+    """
+    from PIL import Image
+
+    noise = Image.frombytes("L", size, random.Random(seed).randbytes(size[0] * size[1])).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    img = Image.blend(noise, gradient, 0.5)
+    if alpha:
+        img.putalpha(Image.linear_gradient("L").rotate(90).resize(size))
+    img.save(path, format, **({"quality": 100} if format == "JPEG" else {}))
+
+
+def bench_images(args):
+    """Throughput of ImageEngine on a thread pool vs a process pool with the same worker count."""
+    width, height = (int(v) for v in args.size.split("x"))
+    workers = args.workers or os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {args.count} {args.size} test images...")
+        paths = []
+        for k in range(args.count):
+            path = Path(tmp) / f"bench_{k:03d}.png"
+            make_image(path, (width, height), k)
+            paths.append(path)
+
+        print(f"{'executor':>8}  {'workers':>7}  {'wall (s)':>9}  {'images/s':>9}")
+        timings = {}
+        for name, executor_cls in (
+            ("thread", concurrent.futures.ThreadPoolExecutor),
+            ("process", concurrent.futures.ProcessPoolExecutor),
+        ):
+            out_dir = Path(tmp) / f"out_{name}"
+            jobs = [(p, p, out_dir) for p in paths]
+            with image_engine.ImageEngine(workers=workers, executor_cls=executor_cls) as engine:
+                t0 = time.perf_counter()
+                for path, _, error in engine.run(jobs):
+                    if error is not None:
+                        print(f"FAILED: {path}: {error}")
+                timings[name] = time.perf_counter() - t0
+            shutil.rmtree(out_dir, ignore_errors=True)
+            print(f"{name:>8}  {workers:>7}  {timings[name]:>9.1f}  {args.count / timings[name]:>9.2f}")
+
+        print(f"process speedup: {timings['thread'] / timings['process']:.2f}x")
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process plus its waited-for children (the ffmpeg runs)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def quality_metrics(output: Path, reference: Path) -> dict:
+    """SSIM and PSNR of output against reference, scaling output back to the reference size."""
+    probe = shrink.first_stream(asyncio.run(shrink.probe_media(reference)), "video") or {}
+    w, h = probe.get("width"), probe.get("height")
+    cmd = [
+        "ffmpeg", "-i", str(output), "-i", str(reference),
+        "-lavfi",
+        f"[0:v]scale={w}:{h}:flags=bicubic,format=yuv444p,split[d1][d2];"
+        f"[1:v]format=yuv444p,split[r1][r2];[d1][r1]ssim;[d2][r2]psnr",
+        "-f", "null", "-",
+    ]
+    try:
+        log = asyncio.run(shrink.run(cmd)).stderr
+    except RuntimeError:
+        return {"ssim": None, "psnr": None}
+    ssim = re.search(r"SSIM .*All:([\d.]+)", log)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", log)
+    return {
+        "ssim": float(ssim.group(1)) if ssim else None,
+        "psnr": float(psnr.group(1)) if psnr else None,
+    }
+
+
+def suite_media(media_dir: Path, quick: bool) -> list[tuple]:
+    """Generate (or reuse) the suite corpus in media_dir; returns (kind, name, path)."""
+    media_dir.mkdir(parents=True, exist_ok=True)
+    media = []
+    for name, source, size, fps, duration, vf in SUITE_CLIPS:
+        if quick and name not in QUICK_CLIPS:
+            continue
+        path = media_dir / f"{name}.mp4"
+        if not path.exists():
+            print(f"Generating {path.name}...")
+            make_clip(path, duration, size, fps, source=source, vf=vf)
+        media.append(("video", name, path))
+    for seed, (name, size, alpha, fmt) in enumerate(SUITE_IMAGES):
+        if quick and name not in QUICK_IMAGES:
+            continue
+        path = media_dir / name
+        if not path.exists():
+            print(f"Generating {path.name}...")
+            make_image(path, size, seed, alpha=alpha, format=fmt)
+        media.append(("image", name, path))
+    return media
+
+
+def run_case(kind: str, name: str, path: Path, out_dir: Path, threads: int, rate_control: str = "2pass") -> dict:
+    """Shrink one input and measure it."""
+    attempts = []
+    result = {"kind": kind, "name": name, "input_size": path.stat().st_size, "status": "done", "error": None}
+
+    def on_event(event):
+        if event["event"] == "attempt_end":
+            attempts.append(event)
+
+    cpu0, t0 = cpu_seconds(), time.perf_counter()
+    try:
+        if kind == "video":
+            info = {}
+            out = shrink.process_video(
+                str(path), str(out_dir / f"{name}_shrunk.mp4"), threads, info=info, on_event=on_event,
+                rate_control=rate_control,
+            )
+            result.update(rung=info.get("rung"), strategy=info.get("strategy"), attempts=len(attempts))
+            target = shrink.TARGET_BYTES
+        else:
+            out = image_shrinker.shrink_image(str(path), str(out_dir))
+            result["attempts"] = None  # the JPEG search runs in memory
+            target = image_shrinker.TARGET_BYTES
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+        out = None
+    result["wall_s"] = round(time.perf_counter() - t0, 3)
+    result["cpu_s"] = round(cpu_seconds() - cpu0, 3)
+
+    if out is not None:
+        size = Path(out).stat().st_size
+        result.update(output_size=size, size_fraction=round(size / target, 4))
+        result.update(quality_metrics(Path(out), path))
+        result["slowest_attempts"] = sorted(
+            ({"attempt": a["attempt"], "status": a["status"], "elapsed": a["elapsed"]} for a in attempts),
+            key=lambda a: -a["elapsed"],
+        )[:3]
+    return result
+
+
+def bench_suite(args):
+    """Run the corpus through process_video / shrink_image and save a JSON report."""
+    # Cached results would measure the cache, not the pipeline
+    os.environ.pop("SHRINK_CACHE_DIR", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        media_dir = Path(args.media_dir) if args.media_dir else Path(tmp) / "media"
+        media = suite_media(media_dir, args.quick)
+
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "cpus": os.cpu_count(),
+            "threads": args.threads,
+            "rate_control": args.rate_control,
+            "settings": {
+                "TARGET_BYTES": shrink.TARGET_BYTES,
+                "SAFETY_FACTOR": shrink.SAFETY_FACTOR,
+                "NEW_ATTEMPTS_PRE_SCALE": shrink.NEW_ATTEMPTS_PRE_SCALE,
+                "DOWNSCALE_WIDTHS": shrink.DOWNSCALE_WIDTHS,
+                "LEGACY_DOWNSCALE_STEPS": shrink.LEGACY_DOWNSCALE_STEPS,
+            },
+            "cases": [],
+        }
+
+        print(f"{'case':<26}  {'wall (s)':>8}  {'cpu (s)':>8}  {'tries':>5}  {'size':>6}  {'ssim':>6}  {'psnr':>6}")
+        for kind, name, path in media:
+            out_dir = Path(tmp) / "out"
+            out_dir.mkdir(exist_ok=True)
+            case = run_case(kind, name, path, out_dir, args.threads, args.rate_control)
+            shutil.rmtree(out_dir, ignore_errors=True)
+            report["cases"].append(case)
+            print_case(case)
+
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"\nSaved {args.output}")
+
+
+def bench_ratecontrol(args):
+    """The suite's videos under 2-pass vs CRF rate control, side by side."""
+    os.environ.pop("SHRINK_CACHE_DIR", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        media_dir = Path(args.media_dir) if args.media_dir else Path(tmp) / "media"
+        videos = [m for m in suite_media(media_dir, args.quick) if m[0] == "video"]
+
+        print(f"{'case':<26}  {'mode':>5}  {'wall (s)':>8}  {'cpu (s)':>8}  {'tries':>5}  {'size':>6}  {'ssim':>6}")
+        for kind, name, path in videos:
+            for mode in shrink.RATE_CONTROLS:
+                out_dir = Path(tmp) / "out"
+                out_dir.mkdir(exist_ok=True)
+                case = run_case(kind, name, path, out_dir, args.threads, mode)
+                shutil.rmtree(out_dir, ignore_errors=True)
+                if case["status"] != "done":
+                    print(f"{name:<26}  {mode:>5}  FAILED: {case['error']}")
+                    continue
+                ssim = f"{case['ssim']:.4f}" if case["ssim"] is not None else "-"
+                print(
+                    f"{name:<26}  {mode:>5}  {case['wall_s']:>8.1f}  {case['cpu_s']:>8.1f}  "
+                    f"{case['attempts']:>5}  {case['size_fraction']:>6.1%}  {ssim:>6}"
+                )
+
+
+def print_case(case: dict):
+    if case["status"] != "done":
+        print(f"{case['name']:<26}  FAILED: {case['error']}")
+        return
+
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else "-"
+
+    print(
+        f"{case['name']:<26}  {case['wall_s']:>8.1f}  {case['cpu_s']:>8.1f}  {fmt(case['attempts'], '>5')}  "
+        f"{case['size_fraction']:>6.1%}  {fmt(case['ssim'], '>6.4f')}  {fmt(case['psnr'], '>6.2f')}"
+    )
+
+
+def bench_compare(args):
+    """Per-case deltas between two suite reports (NEW relative to OLD)."""
+    old = {c["name"]: c for c in json.loads(Path(args.old).read_text())["cases"]}
+    new = {c["name"]: c for c in json.loads(Path(args.new).read_text())["cases"]}
+
+    def delta(a, b, key, spec):
+        x, y = a.get(key), b.get(key)
+        if x is None or y is None:
+            return "-"
+        return format(y - x, spec)
+
+    print(f"{'case':<26}  {'wall':>8}  {'cpu':>8}  {'tries':>5}  {'size':>7}  {'ssim':>8}  {'psnr':>6}")
+    for name in [n for n in new if n in old]:
+        a, b = old[name], new[name]
+        if a["status"] != "done" or b["status"] != "done":
+            print(f"{name:<26}  {a['status']} -> {b['status']}")
+            continue
+        wall = f"{(b['wall_s'] / a['wall_s'] - 1):+.0%}" if a["wall_s"] else "-"
+        cpu = f"{(b['cpu_s'] / a['cpu_s'] - 1):+.0%}" if a["cpu_s"] else "-"
+        print(
+            f"{name:<26}  {wall:>8}  {cpu:>8}  {delta(a, b, 'attempts', '+d'):>5}  "
+            f"{delta(a, b, 'size_fraction', '+.1%'):>7}  {delta(a, b, 'ssim', '+.4f'):>8}  {delta(a, b, 'psnr', '+.2f'):>6}"
+        )
+    for name in new.keys() ^ old.keys():
+        print(f"{name:<26}  only in {'new' if name in new else 'old'}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the media shrinking pipeline.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("chunked", help="Wall-time scaling of the chunked engine by core count")
+    p.add_argument("--duration", type=int, default=120, help="Test clip length in seconds (default: 120)")
+    p.add_argument(
+        "--cores", type=int, nargs="+",
+        default=[n for n in (1, 2, 4, 8, 16, 32) if n <= (os.cpu_count() or 1)],
+        help="Core counts to measure (default: powers of two up to cpu_count)",
+    )
+    p.set_defaults(func=bench_chunked, needs_ffmpeg=True)
+
+    p = sub.add_parser("images", help="Image throughput: thread pool vs process pool")
+    p.add_argument("--count", type=int, default=16, help="Number of test images (default: 16)")
+    p.add_argument("--size", default="6000x4000", help="Test image size WxH (default: 6000x4000)")
+    p.add_argument("--workers", type=int, help="Workers for both pools (default: number of cores)")
+    p.set_defaults(func=bench_images, needs_ffmpeg=False)
+
+    p = sub.add_parser("suite", help="Run a generated corpus through the pipeline and save a JSON report")
+    p.add_argument("-o", "--output", default="benchmark.json", help="Report path (default: benchmark.json)")
+    p.add_argument("--quick", action="store_true", help="Only one clip and two images")
+    p.add_argument("--media-dir", help="Keep generated media here and reuse it across runs (default: temp dir)")
+    p.add_argument("--threads", type=int, default=4, help="FFmpeg threads per encode (default: 4)")
+    p.add_argument("--rate-control", choices=shrink.RATE_CONTROLS, default="2pass", help="Video rate control")
+    p.set_defaults(func=bench_suite, needs_ffmpeg=True)
+
+    p = sub.add_parser("ratecontrol", help="Wall time and size utilization: 2-pass vs CRF search")
+    p.add_argument("--quick", action="store_true", help="Only one clip")
+    p.add_argument("--media-dir", help="Keep generated media here and reuse it across runs (default: temp dir)")
+    p.add_argument("--threads", type=int, default=4, help="FFmpeg threads per encode (default: 4)")
+    p.set_defaults(func=bench_ratecontrol, needs_ffmpeg=True)
+
+    p = sub.add_parser("compare", help="Diff two suite reports")
+    p.add_argument("old", help="Baseline report")
+    p.add_argument("new", help="Report to compare against the baseline")
+    p.set_defaults(func=bench_compare, needs_ffmpeg=False)
+
+    args = ap.parse_args()
+    if args.needs_ffmpeg and not shrink.ffmpeg_exists():
+        print("Error: ffmpeg/ffprobe not found.")
+        sys.exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
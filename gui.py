@@ -3,10 +3,19 @@ from tkinter import filedialog, messagebox, ttk
 import threading
 import concurrent.futures
 import queue
+from collections import deque
 from pathlib import Path
 
 import shrink
-import image_shrinker
+import image_engine
+import resources
+
+# check_queue runs every POLL_MS (sooner while behind); each tick drains at most
+# MAX_MESSAGES_PER_TICK messages and applies at most MAX_UPDATES_PER_TICK rows.
+POLL_MS = 100
+BACKLOG_POLL_MS = 15
+MAX_MESSAGES_PER_TICK = 20000
+MAX_UPDATES_PER_TICK = 300
 
 class App:
     def __init__(self, root):
@@ -16,8 +25,14 @@ class App:
 
         # Data
         self.files = [] # list of (path, item_id)
+        self.file_index = {} # path -> item_id, for duplicate checks
+        self.pending_status = {} # item_id -> latest status not yet shown
+        self.done_pending = False
         self.processing = False
         self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        # Image worker processes start on first use and are reused across runs
+        self.image_engine = image_engine.ImageEngine()
 
         # GUI Elements
         main_frame = tk.Frame(root)
@@ -33,6 +48,9 @@ class App:
         self.btn_start = tk.Button(btn_frame, text="Start Shrinking", command=self.start_processing, state=tk.DISABLED, width=15, bg="#dddddd")
         self.btn_start.pack(side=tk.LEFT)
 
+        self.btn_cancel = tk.Button(btn_frame, text="Cancel", command=self.cancel_processing, state=tk.DISABLED, width=10)
+        self.btn_cancel.pack(side=tk.LEFT, padx=(10, 0))
+
         self.btn_clear = tk.Button(btn_frame, text="Clear List", command=self.clear_list, width=10)
         self.btn_clear.pack(side=tk.RIGHT)
 
@@ -83,10 +101,11 @@ class App:
         if filenames:
             for f in filenames:
                 # Avoid exact duplicates in list
-                if any(existing[0] == f for existing in self.files):
+                if f in self.file_index:
                     continue
                 item_id = self.tree.insert("", tk.END, values=(f, "Pending"))
                 self.files.append((f, item_id))
+                self.file_index[f] = item_id
 
             if self.files:
                 self.btn_start.config(state=tk.NORMAL)
@@ -97,6 +116,8 @@ class App:
             return
         self.tree.delete(*self.tree.get_children())
         self.files = []
+        self.file_index = {}
+        self.pending_status = {}
         self.btn_start.config(state=tk.DISABLED)
         self.status_lbl.config(text="List cleared.")
         self.progress["value"] = 0
@@ -109,6 +130,8 @@ class App:
         self.btn_select.config(state=tk.DISABLED)
         self.btn_start.config(state=tk.DISABLED)
         self.btn_clear.config(state=tk.DISABLED)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.cancel_event.clear()
 
         self.progress["maximum"] = len(self.files)
         self.progress["value"] = 0
@@ -117,6 +140,12 @@ class App:
         # Start background thread
         threading.Thread(target=self.process_thread, daemon=True).start()
 
+    def cancel_processing(self):
+        # Queued files are skipped and running videos stop; running images finish
+        self.cancel_event.set()
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.status_lbl.config(text="Cancelling...")
+
     def process_thread(self):
         images = []
         videos = []
@@ -132,76 +161,135 @@ class App:
                 self.queue.put(("update_status", (item_id, "Skipped (Unknown Type)")))
                 self.queue.put(("progress", 1))
 
-        # 1. Process Images in Parallel
-        # Mark all images as Queued
-        for _, item_id in images:
+        for _, item_id in images + videos:
             self.queue.put(("update_status", (item_id, "Queued")))
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            future_to_item = {
-                executor.submit(self.process_single_image, f): item_id
-                for f, item_id in images
-            }
-
-            for future in concurrent.futures.as_completed(future_to_item):
-                item_id = future_to_item[future]
-                try:
-                    future.result() # Will raise exception if occurred
-                    self.queue.put(("update_status", (item_id, "Done")))
-                except Exception as e:
-                    self.queue.put(("update_status", (item_id, f"Error: {e}")))
-                self.queue.put(("progress", 1))
-
-        # 2. Process Videos Sequentially
-        for f, item_id in videos:
-            self.queue.put(("update_status", (item_id, "Processing...")))
-            try:
-                self.process_single_video(f)
-                self.queue.put(("update_status", (item_id, "Done")))
-            except Exception as e:
-                self.queue.put(("update_status", (item_id, f"Error: {e}")))
+        # Images and videos share one CPU budget: videos start first whenever
+        # their threads fit, images fill the remaining cores.
+        cpus = resources.available_cpus()
+        max_videos, threads = resources.video_plan(cpus, len(videos), len(images))
+        images = deque(images)
+        videos = deque(videos)
+        budget = cpus
+        running = {}  # future -> (item_id, kind)
+        reported = {}  # item_id -> fraction of its progress-bar step already shown
+
+        def cost(kind):
+            return threads if kind == "video" else 1
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_videos) as video_pool:
+            def fill():
+                nonlocal budget
+                while not self.cancel_event.is_set():
+                    running_videos = sum(kind == "video" for _, kind in running.values())
+                    if videos and threads <= budget and running_videos < max_videos:
+                        f, item_id = videos.popleft()
+                        future = video_pool.submit(self.process_single_video, f, threads, item_id, reported)
+                        kind = "video"
+                    elif images and budget >= 1:
+                        f, item_id = images[0]
+                        future = self.image_engine.try_submit(f, image_engine.default_output_dir(f))
+                        if future is None:
+                            return
+                        images.popleft()
+                        kind = "image"
+                    else:
+                        return
+                    budget -= cost(kind)
+                    running[future] = (item_id, kind)
+                    self.queue.put(("update_status", (item_id, "Processing...")))
+
+            fill()
+            while running:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    item_id, kind = running.pop(future)
+                    budget += cost(kind)
+                    try:
+                        info = future.result() # Will raise exception if occurred
+                        status = "Done"
+                        if info and info.get("peak_rss"):
+                            status += f" ({info['peak_rss'] / (1024 * 1024):.0f} MB worker peak)"
+                        self.queue.put(("update_status", (item_id, status)))
+                    except shrink.EncodeAborted:
+                        self.queue.put(("update_status", (item_id, "Cancelled")))
+                    except Exception as e:
+                        self.queue.put(("update_status", (item_id, f"Error: {e}")))
+                    self.queue.put(("progress", 1 - reported.pop(item_id, 0)))
+                fill()
+
+        for _, item_id in list(images) + list(videos):
+            self.queue.put(("update_status", (item_id, "Cancelled")))
             self.queue.put(("progress", 1))
 
         self.queue.put(("done", None))
 
-    def process_single_image(self, filepath):
-        p = Path(filepath)
-        output_dir = p.parent / "output"
-        # Directory creation is handled in shrink_image, but explicit check doesn't hurt
-        image_shrinker.shrink_image(filepath, str(output_dir))
-
-    def process_single_video(self, filepath):
+    def process_single_video(self, filepath, threads=4, item_id=None, reported=None):
         p = Path(filepath)
         output_dir = p.parent / "output"
         output_dir.mkdir(parents=True, exist_ok=True)
 
+        def on_event(event):
+            if item_id is None or event["event"] != "progress" or "percent" not in event:
+                return
+            if event["stage"] == "crf":
+                # Single-pass CRF encode: the whole attempt is one run
+                fraction = event["percent"] / 100
+            else:
+                # Pass 1 covers the first half of an attempt, pass 2 the second
+                passes_done = 1 if event["stage"] == "pass2" else 0
+                fraction = (passes_done + event["percent"] / 100) / 2
+            self.queue.put(("update_status", (item_id, f"Encoding {fraction:.0%} ({event['attempt']})")))
+            # A new ladder attempt starts from zero; the bar only moves forward
+            if reported is not None and fraction > reported.get(item_id, 0):
+                self.queue.put(("progress", fraction - reported.get(item_id, 0)))
+                reported[item_id] = fraction
+
         output_path = output_dir / (p.stem + "_shrunk.mp4")
-        shrink.process_video(filepath, str(output_path))
+        shrink.process_video(
+            filepath, str(output_path), threads=threads, on_event=on_event, cancel=self.cancel_event,
+        )
 
     def check_queue(self):
+        # Coalesce: only the latest status per row matters, and progress deltas add up
+        progress = 0
         try:
-            while True:
+            for _ in range(MAX_MESSAGES_PER_TICK):
                 msg, data = self.queue.get_nowait()
                 if msg == "update_status":
                     item_id, status = data
-                    # Check if item exists (in case cleared, though buttons disabled)
-                    if self.tree.exists(item_id):
-                        self.tree.set(item_id, "status", status)
-                        # Ensure row is visible
-                        self.tree.see(item_id)
+                    self.pending_status[item_id] = status
                 elif msg == "progress":
-                    self.progress["value"] += data
+                    progress += data
                 elif msg == "done":
-                    self.processing = False
-                    self.btn_select.config(state=tk.NORMAL)
-                    self.btn_start.config(state=tk.NORMAL)
-                    self.btn_clear.config(state=tk.NORMAL)
-                    self.status_lbl.config(text="All tasks completed.")
-                    messagebox.showinfo("Finished", "Processing complete!")
+                    self.done_pending = True
         except queue.Empty:
             pass
+
+        try:
+            if progress:
+                self.progress["value"] += progress
+
+            # Bounded number of row updates per tick keeps the main loop responsive
+            updates = list(self.pending_status.items())
+            self.pending_status = dict(updates[MAX_UPDATES_PER_TICK:])
+            for item_id, status in updates[:MAX_UPDATES_PER_TICK]:
+                # Check if item exists (in case cleared, though buttons disabled)
+                if self.tree.exists(item_id):
+                    self.tree.set(item_id, "status", status)
+
+            if self.done_pending and not self.pending_status and self.queue.empty():
+                self.done_pending = False
+                self.processing = False
+                self.btn_select.config(state=tk.NORMAL)
+                self.btn_start.config(state=tk.NORMAL)
+                self.btn_clear.config(state=tk.NORMAL)
+                self.btn_cancel.config(state=tk.DISABLED)
+                self.status_lbl.config(text="Cancelled." if self.cancel_event.is_set() else "All tasks completed.")
+                messagebox.showinfo("Finished", "Processing complete!")
         finally:
-            self.root.after(100, self.check_queue)
+            behind = self.pending_status or not self.queue.empty()
+            self.root.after(BACKLOG_POLL_MS if behind else POLL_MS, self.check_queue)
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,146 @@
+"""
+Process-pool image engine shared by the GUI and the command line.
+
+  python image_engine.py IMAGE [IMAGE ...] [-o OUTPUT_DIR] [--workers N]
+
+JPEG optimize encodes and LANCZOS resizes are CPU-bound and scale poorly across
+threads, so images are shrunk in worker processes instead.
+"""
+import argparse
+import concurrent.futures
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import image_shrinker
+import resources
+
+
+def default_output_dir(path) -> Path:
+    # Same place the GUI has always used
+    return Path(path).parent / "output"
+
+
+def shrink_one(path: str, output_dir: str) -> dict:
+    """
+    Worker entry point: shrink one image, return {"output", "peak_rss"}.
+    peak_rss is the worker process's peak RSS while this image ran; each worker
+    runs one image at a time, so nothing else contributes to it.
+    """
+    with resources.RssSampler() as rss:
+        output = image_shrinker.shrink_image(path, output_dir)
+    return {"output": output, "peak_rss": rss.peak}
+
+
+class ImageEngine:
+    """
+    Shrinks images on a pool of worker processes (one per CPU by default) and
+    streams results back as they finish. Jobs are admitted only while their
+    estimated memory fits the budget, so a folder of huge scans cannot exhaust
+    RAM. Keep one engine around to reuse warm workers; close() shuts it down.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        memory_budget: int | None = None,
+        executor_cls=concurrent.futures.ProcessPoolExecutor,
+    ):
+        self.workers = workers or resources.available_cpus()
+        self.memory = resources.MemoryBudget(memory_budget or resources.default_memory_budget())
+        self._pool = executor_cls(max_workers=self.workers)
+
+    def try_submit(self, path, output_dir) -> concurrent.futures.Future | None:
+        """
+        Start shrinking one image if its estimated memory fits the budget right
+        now, else return None. The future's result is shrink_one()'s info dict.
+        A job always fits when nothing else is running.
+
+        The returned future completes only after the job's memory is released,
+        so a scheduler woken by it can admit the next image straight away.
+        """
+        try:
+            need = image_shrinker.estimate_memory(path)
+        except Exception:
+            need = 0  # unreadable header; the job itself will report the error
+        if not self.memory.try_acquire(need):
+            return None
+
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def finished(job):
+            # Waiters on the pool's own future wake before its callbacks run
+            self.memory.release(need)
+            if job.cancelled():
+                future.set_exception(concurrent.futures.CancelledError())
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+
+        self._pool.submit(shrink_one, str(path), str(output_dir)).add_done_callback(finished)
+        return future
+
+    def run(self, jobs):
+        """
+        Shrink (key, path, output_dir) jobs; yields (key, info, error) as each
+        finishes, where info has "output" and "peak_rss" on success and error is
+        the raised exception on failure.
+        """
+        pending = deque(jobs)
+        running = {}
+
+        while pending or running:
+            while pending and len(running) < self.workers:
+                key, path, output_dir = pending[0]
+                future = self.try_submit(path, output_dir)
+                if future is None:
+                    break
+                pending.popleft()
+                running[future] = key
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Shrink images to <= 9.5MB using all CPU cores.")
+    ap.add_argument("images", nargs="+", help="Image files (JPG/PNG)")
+    ap.add_argument("-o", "--output", help="Output folder (default: 'output' next to each image)")
+    ap.add_argument("--workers", type=int, help="Worker processes (default: number of cores)")
+    args = ap.parse_args()
+
+    jobs = [(p, p, args.output or default_output_dir(p)) for p in args.images]
+    failed = 0
+    start = time.perf_counter()
+    with ImageEngine(workers=args.workers) as engine:
+        for path, info, error in engine.run(jobs):
+            if error is not None:
+                failed += 1
+                print(f"FAILED: {path}: {error}")
+            else:
+                print(f"Done: {path} -> {info['output']}")
+
+    print(f"\n{len(jobs)} images in {time.perf_counter() - start:.1f}s ({failed} failed)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,211 @@
+import io
+import math
 import shutil
 from pathlib import Path
 from PIL import Image
 
+import result_cache
+
 TARGET_MB = 9.5
 TARGET_BYTES = int(TARGET_MB * 1024 * 1024)
 
-def shrink_image(file_path: str, output_dir: str) -> str:
+# JPEG quality search range (Strategy A) and the fixed quality used when resizing (Strategy B)
+QUALITY_MAX = 95
+QUALITY_MIN = 50
+QUALITY_STEP = 5
+RESIZE_QUALITY = 85
+
+# Strategy B: aim slightly under target, accept anything above RESIZE_GOOD_ENOUGH
+# of it, and give up refining after RESIZE_MAX_TRIES encodes once something fits.
+RESIZE_MARGIN = 0.97
+RESIZE_GOOD_ENOUGH = 0.9
+RESIZE_MAX_TRIES = 4
+MIN_DIMENSION = 100
+
+# JPEG sources: if a 1/8-scale draft decode predicts that full resolution is this
+# many times over target even at QUALITY_MIN, skip Strategy A and decode in draft
+# mode at DRAFT_HEADROOM times the predicted final size instead of full resolution.
+DRAFT_SKIP_FACTOR = 2.0
+DRAFT_HEADROOM = 1.5
+
+# Transparent images are composited onto white this many rows at a time, so the
+# RGBA conversion never exists at full resolution. The decoded source still does:
+# PIL decodes PNG/GIF in one go, so flattening costs source + RGB + one strip.
+STRIP_ROWS = 256
+
+# Bytes per pixel by PIL mode, for memory estimates
+MODE_BYTES = {"1": 1, "L": 1, "P": 1, "LA": 2, "I;16": 2, "RGB": 3, "YCbCr": 3, "RGBA": 4, "CMYK": 4, "I": 4, "F": 4}
+
+
+def estimate_memory(file_path) -> int:
+    """
+    Rough peak memory for shrink_image on this file, read from the header only:
+    full decoded source + one RGBA strip (flattening alpha) + RGB working copy
+    + one resized copy + libjpeg's coefficient buffer (optimize=True keeps every
+    coefficient) + the encoded buffer and its getvalue() copy, plus one more
+    RGB-sized block of allocator slack. The source is freed before encoding,
+    but the allocator rarely hands that back to the OS, so the phases are
+    summed. JPEG draft decodes use less.
+    Schedulers use it as the per-job memory cost.
+    """
+    with Image.open(file_path) as img:
+        pixels = img.width * img.height
+        source = pixels * MODE_BYTES.get(img.mode, 4)
+        strip = img.width * min(STRIP_ROWS, img.height) * (MODE_BYTES.get(img.mode, 4) + 4)
+    return source + strip + pixels * 3 * 4 + TARGET_BYTES * 2
+
+
+def flatten_alpha(img: Image.Image) -> Image.Image:
+    """
+    Composite a transparent image onto white, one strip of STRIP_ROWS at a time.
+    The first crop loads img fully, so peak memory is the decoded source plus
+    the RGB result plus one strip (see estimate_memory).
+    """
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    for top in range(0, img.height, STRIP_ROWS):
+        box = (0, top, img.width, min(top + STRIP_ROWS, img.height))
+        strip = img.crop(box).convert("RGBA")
+        background.paste(strip, box[:2], mask=strip)  # RGBA mask uses the alpha band
+        del strip
+    return background
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    """Encode to JPEG in memory."""
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def best_quality(img: Image.Image) -> tuple[int, bytes] | None:
+    """
+    Binary search for the highest quality (QUALITY_MIN..QUALITY_MAX in
+    QUALITY_STEP steps) whose encode fits TARGET_BYTES.
+    Returns (quality, jpeg bytes), or None if even QUALITY_MIN is too big.
+    """
+    qualities = list(range(QUALITY_MIN, QUALITY_MAX + 1, QUALITY_STEP))
+    lo, hi = 0, len(qualities) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = encode_jpeg(img, qualities[mid])
+        if len(data) <= TARGET_BYTES:
+            best = (qualities[mid], data)
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def shrink_image(
+    file_path: str,
+    output_dir: str,
+    cache: result_cache.ResultCache | None = None,
+) -> str:
     """
     Shrinks an image file to be under 9.5MB.
     - If already smaller, copies it.
     - If larger, converts to JPG and reduces quality.
     - If still larger, resizes dimensions.
+    cache defaults to ResultCache.from_env(); identical content is served from it.
     Returns the path to the output file.
     """
     input_path = Path(file_path).resolve()
     output_dir_path = Path(output_dir).resolve()
     output_dir_path.mkdir(parents=True, exist_ok=True)
 
+    if cache is None:
+        cache = result_cache.ResultCache.from_env()
+    if cache is None:
+        return _shrink_image(input_path, output_dir_path)
+
+    settings = {
+        "kind": "image",
+        "target_bytes": TARGET_BYTES,
+        "quality": [QUALITY_MAX, QUALITY_MIN, QUALITY_STEP, RESIZE_QUALITY],
+        "resize": [RESIZE_MARGIN, RESIZE_GOOD_ENOUGH, RESIZE_MAX_TRIES, MIN_DIMENSION],
+    }
+    cache_key = result_cache.content_key(input_path, settings)
+    meta = cache.lookup(cache_key, lambda meta: output_dir_path / (input_path.stem + meta["suffix"]))
+    if meta and "output" in meta:
+        return meta["output"]
+
+    output_path = Path(_shrink_image(input_path, output_dir_path))
+    cache.store(cache_key, {"suffix": output_path.suffix}, output=output_path)
+    return str(output_path)
+
+
+def jpeg_draft_size(input_path: Path) -> tuple[int, int] | None:
+    """
+    For JPEGs that clearly cannot fit at full resolution, return the size to
+    request from Image.draft() for the resize path; None if full resolution
+    might still fit (or the file is not a JPEG).
+    Uses a 1/8-scale DCT draft decode, which costs a fraction of a full decode.
+    """
+    with Image.open(input_path) as probe:
+        if probe.format != "JPEG":
+            return None
+        w, h = probe.size
+        probe.draft("RGB", (max(w // 8, 1), max(h // 8, 1)))
+        small = probe.convert("RGB")
+
+    # Downscaled images are denser, so these per-pixel figures overestimate full-res size
+    pixels = small.width * small.height
+    if len(encode_jpeg(small, QUALITY_MIN)) / pixels * w * h <= TARGET_BYTES * DRAFT_SKIP_FACTOR:
+        return None
+
+    bpp = len(encode_jpeg(small, RESIZE_QUALITY)) / pixels
+    scale = min(1.0, math.sqrt(TARGET_BYTES / (bpp * w * h)) * DRAFT_HEADROOM)
+    return int(w * scale), int(h * scale)
+
+
+def resize_to_fit(img: Image.Image) -> bytes:
+    """
+    Strategy B: find a size whose RESIZE_QUALITY encode fits TARGET_BYTES.
+    The first guess comes from bytes-per-pixel measured on img; each encode then
+    corrects the model (JPEG size ~ pixel count), bracketed by the largest scale
+    known to fit and the smallest known not to.
+    """
+    w, h = img.size
+    data = encode_jpeg(img, RESIZE_QUALITY)
+    if len(data) <= TARGET_BYTES:
+        return data  # a draft-decoded image can already be small enough
+    scale = math.sqrt(TARGET_BYTES * RESIZE_MARGIN / len(data))
+
+    fits, misses = 0.0, 1.0
+    best = None
+    tries = 0
+    while True:
+        new_w = int(w * scale)
+        new_h = int(h * scale)
+
+        # Safety break
+        if new_w < MIN_DIMENSION or new_h < MIN_DIMENSION:
+            raise RuntimeError("Cannot shrink image under 9.5MB without making it too small.")
+
+        resized_img = img.resize((new_w, new_h), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        data = encode_jpeg(resized_img, RESIZE_QUALITY)
+        del resized_img
+        tries += 1
+
+        if len(data) <= TARGET_BYTES:
+            if scale > fits:
+                fits, best = scale, data
+            if len(data) >= TARGET_BYTES * RESIZE_GOOD_ENOUGH:
+                return best
+        else:
+            misses = min(misses, scale)
+
+        if best is not None and tries >= RESIZE_MAX_TRIES:
+            return best
+
+        guess = scale * math.sqrt(TARGET_BYTES * RESIZE_MARGIN / len(data))
+        if not fits < guess < misses:
+            guess = (fits + misses) / 2 if fits else misses * 0.9
+        scale = guess
+
+
+def _shrink_image(input_path: Path, output_dir_path: Path) -> str:
     input_size = input_path.stat().st_size
 
     # Case 1: Already small enough
@@ -35,43 +224,32 @@ def shrink_image(file_path: str, output_dir: str) -> str:
     output_path = output_dir_path / (input_path.stem + ".jpg")
 
     try:
-        with Image.open(input_path) as img:
-            # Handle transparency replacement with white background
-            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
-                img = img.convert("RGBA")
-                background = Image.new("RGB", img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3]) # 3 is alpha channel in RGBA
-                img = background
-            else:
-                img = img.convert("RGB")
+        # Huge JPEGs that cannot fit at full resolution are never decoded at full resolution
+        draft_size = jpeg_draft_size(input_path)
 
-            # Strategy A: Reduce Quality first (without resizing)
-            # Loop quality from 95 down to 50
-            for quality in range(95, 45, -5):
-                img.save(output_path, "JPEG", quality=quality, optimize=True)
-                if output_path.stat().st_size <= TARGET_BYTES:
-                    return str(output_path)
+        with Image.open(input_path) as src:
+            if draft_size:
+                src.draft("RGB", draft_size)
 
-            # Strategy B: Resize + Quality 85
-            # If we are here, quality 50 didn't work.
-            # Start resizing.
-
-            scale = 0.9
-            while True:
-                new_w = int(img.width * scale)
-                new_h = int(img.height * scale)
-
-                # Safety break
-                if new_w < 100 or new_h < 100:
-                    raise RuntimeError("Cannot shrink image under 9.5MB without making it too small.")
-
-                resized_img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                resized_img.save(output_path, "JPEG", quality=85, optimize=True)
+            # Handle transparency replacement with white background
+            if src.mode in ("RGBA", "LA") or (src.mode == "P" and "transparency" in src.info):
+                img = flatten_alpha(src)
+            else:
+                img = src.convert("RGB")
+        # Leaving the block closes src and frees the decoded source pixels
 
-                if output_path.stat().st_size <= TARGET_BYTES:
-                    return str(output_path)
+        # Strategy A: Reduce Quality first (without resizing)
+        # Search quality 95..50 in memory; only the winner is written to disk
+        if not draft_size:
+            found = best_quality(img)
+            if found:
+                output_path.write_bytes(found[1])
+                return str(output_path)
 
-                scale *= 0.9 # Reduce size by another ~10% relative to original
+        # Strategy B: Resize + Quality 85
+        # If we are here, quality 50 didn't work (or clearly could not).
+        output_path.write_bytes(resize_to_fit(img))
+        return str(output_path)
 
     except Exception as e:
         # Cleanup partial file on error
@@ -0,0 +1,102 @@
+"""
+Persistent batch manifest (SQLite) so re-runs only touch new, changed or failed inputs.
+
+One row per input path records the size/mtime it was processed at, its status,
+winning rung, output size and elapsed time. Rows are committed as each job
+starts and finishes, so a crash or Ctrl-C leaves "running" rows that the next
+run simply picks up again.
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    kind        TEXT,
+    size        INTEGER,
+    mtime_ns    INTEGER,
+    status      TEXT,
+    output      TEXT,
+    output_size INTEGER,
+    rung        TEXT,
+    elapsed     REAL,
+    error       TEXT,
+    updated     REAL
+)
+"""
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def load(self) -> dict[str, dict]:
+        """All rows keyed by path, so per-file decisions are a dict lookup."""
+        cur = self.db.execute("SELECT path, size, mtime_ns, status, output FROM files")
+        return {
+            path: {"size": size, "mtime_ns": mtime_ns, "status": status, "output": output}
+            for path, size, mtime_ns, status, output in cur
+        }
+
+    def get(self, path: str) -> dict | None:
+        """One input's row, for callers that decide file by file (watch.py)."""
+        row = self.db.execute("SELECT size, mtime_ns, status, output FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, status, output = row
+        return {"size": size, "mtime_ns": mtime_ns, "status": status, "output": output}
+
+    @staticmethod
+    def needs_work(row: dict | None, size: int, mtime_ns: int, retry_failed: bool = False) -> bool:
+        """
+        Decide whether an input needs (re)processing given its manifest row.
+        Unchanged inputs are skipped if done (and their output still exists),
+        and if failed unless retry_failed. Anything else (new, changed, output
+        deleted, or left "running" by a crash) is redone.
+        """
+        if row is None:
+            return True
+        if row["size"] != size or row["mtime_ns"] != mtime_ns:
+            return True
+        if row["status"] == "done":
+            output = row.get("output")
+            return not output or not Path(output).exists()
+        if row["status"] == "failed":
+            return retry_failed
+        return True
+
+    def mark_running(self, path: str, kind: str, size: int, mtime_ns: int):
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, kind, size, mtime_ns, status, updated) VALUES (?, ?, ?, ?, 'running', ?)",
+            (path, kind, size, mtime_ns, time.time()),
+        )
+        self.db.commit()
+
+    def record(self, result: dict):
+        """Store a finished batch.run_job result."""
+        rung = result.get("rung")
+        self.db.execute(
+            "UPDATE files SET status = ?, output = ?, output_size = ?, rung = ?, elapsed = ?, error = ?, updated = ? "
+            "WHERE path = ?",
+            (
+                result["status"],
+                result["output"],
+                result["output_size"],
+                json.dumps(rung) if rung is not None else None,
+                result["elapsed"],
+                result["error"],
+                time.time(),
+                result["path"],
+            ),
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
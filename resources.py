@@ -0,0 +1,159 @@
+"""
+Machine resource helpers shared by the GUI and batch schedulers.
+"""
+import contextlib
+import os
+import threading
+
+# Use at most this fraction of currently available RAM for in-flight image jobs
+MEMORY_BUDGET_FRACTION = 0.5
+FALLBACK_MEMORY_BYTES = 2 * 1024 ** 3
+
+# x264/x265 keep about this many threads busy per encode; more cores go to more jobs
+VIDEO_THREADS = 4
+
+
+def cgroup_cpu_quota() -> float | None:
+    """CPU quota of this process's cgroup in cores (v2 cpu.max or v1 CFS), or None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: its affinity mask, capped by any cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        # Round down: running more threads than the quota just gets them throttled
+        cpus = min(cpus, max(1, int(quota)))
+    return cpus
+
+
+def video_plan(cpus: int, videos: int, images: int = 0) -> tuple[int, int]:
+    """
+    (concurrent videos, ffmpeg threads per video) for a mixed batch on `cpus`.
+    While images are queued, a quarter of the cores is kept free for them.
+    """
+    reserve = min(images, cpus // 4)
+    video_cpus = max(1, cpus - reserve)
+    concurrent = max(1, min(videos, video_cpus // VIDEO_THREADS))
+    return concurrent, max(1, video_cpus // concurrent)
+
+
+def available_memory() -> int:
+    """Bytes of RAM available for new work (MemAvailable on Linux, physical RAM elsewhere)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return FALLBACK_MEMORY_BYTES
+
+
+def default_memory_budget() -> int:
+    return int(available_memory() * MEMORY_BUDGET_FRACTION)
+
+
+def current_rss() -> int | None:
+    """
+    Resident set size of this process in bytes, or None if unavailable.
+    Linux only: getrusage's ru_maxrss is a lifetime high-water mark, which would
+    make every later sample in a reused worker report an earlier job's peak.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """
+    Context manager that samples this process's RSS in the background and
+    records the peak seen while the block runs. The figure is process-wide, so
+    use it only where one job runs per process (image and batch workers).
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+class MemoryBudget:
+    """
+    Blocking byte budget for concurrent jobs. reserve(n) waits until n bytes fit
+    under the total; a job larger than the whole budget still runs, but alone.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self, n: int) -> bool:
+        with self._cond:
+            if self.used and self.used + n > self.total:
+                return False
+            self.used += n
+            return True
+
+    def acquire(self, n: int):
+        with self._cond:
+            self._cond.wait_for(lambda: not self.used or self.used + n <= self.total)
+            self.used += n
+
+    def release(self, n: int):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, n: int):
+        self.acquire(n)
+        try:
+            yield
+        finally:
+            self.release(n)
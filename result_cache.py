@@ -0,0 +1,203 @@
+"""
+Content-addressed cache of shrink results, shared by shrink.py and image_shrinker.py.
+
+Entries are keyed by a fast content hash of the input (size plus sampled chunks)
+and the settings that affect the output, so renamed or re-uploaded copies of the
+same media hit the cache regardless of path.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+DEFAULT_MAX_MB = 2048
+
+# Content hash: file size plus HASH_SAMPLES evenly spaced chunks (whole file if small)
+HASH_CHUNK = 1024 * 1024
+HASH_SAMPLES = 8
+
+# Eviction trims down to this fraction of max_bytes so it does not run on every store
+EVICT_TO = 0.9
+
+# Stores between full size scans even while this process's own estimate is under
+# the limit, to account for what other processes have written meanwhile
+SCAN_EVERY = 64
+
+
+def content_key(path, settings: dict) -> str:
+    """Hash of the input's content and the settings that influence the result."""
+    path = Path(path)
+    size = path.stat().st_size
+
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= HASH_CHUNK * HASH_SAMPLES:
+            for block in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(block)
+        else:
+            step = (size - HASH_CHUNK) // (HASH_SAMPLES - 1)
+            for k in range(HASH_SAMPLES):
+                f.seek(k * step)
+                h.update(f.read(HASH_CHUNK))
+
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: Path):
+    """Exclusive inter-process lock on lock_path (flock on POSIX, msvcrt on Windows)."""
+    with open(lock_path, "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class ResultCache:
+    """
+    On-disk layout: <root>/<key[:2]>/<key>.json holds the winning parameters and
+    <key>.out holds the winning output bytes.
+
+    File mtimes are the LRU clock: hits touch them and eviction removes the
+    oldest outputs first (parameters are tiny and outlive their outputs, so a
+    later run can still jump straight to the known-good settings). Entries are
+    written to a temp file and os.replace()d into place, and eviction runs under
+    a lock file, so several worker processes can share one cache safely.
+    """
+
+    def __init__(self, root, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = Path(root).expanduser().resolve()
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._estimate = None  # bytes on disk as of the last scan, plus what we stored since
+        self._stores = 0
+
+    @classmethod
+    def from_env(cls):
+        """Cache configured by SHRINK_CACHE_DIR / SHRINK_CACHE_MAX_MB, or None if unset."""
+        root = os.environ.get("SHRINK_CACHE_DIR")
+        if not root:
+            return None
+        max_mb = float(os.environ.get("SHRINK_CACHE_MAX_MB", DEFAULT_MAX_MB))
+        return cls(root, int(max_mb * 1024 * 1024))
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        folder = self.root / key[:2]
+        return folder / f"{key}.json", folder / f"{key}.out"
+
+    def lookup(self, key: str, dest=None) -> dict | None:
+        """
+        Return the stored parameters for key (None on a miss).
+        If dest is given and the output is still cached, it is copied to dest and
+        the returned dict has "output": str(dest); otherwise "output" is absent.
+        dest may also be a function of the parameters returning the path, for
+        outputs whose name depends on them (e.g. a stored suffix).
+        """
+        meta_path, out_path = self._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        with contextlib.suppress(OSError):
+            os.utime(meta_path)
+
+        if callable(dest):
+            dest = dest(meta)
+        if dest is not None:
+            try:
+                shutil.copyfile(out_path, dest)
+                os.utime(out_path)
+                meta["output"] = str(dest)
+            except OSError:
+                # Output evicted (or evicted mid-copy); parameters are still useful
+                with contextlib.suppress(OSError):
+                    Path(dest).unlink()
+
+        return meta
+
+    def store(self, key: str, meta: dict, output=None):
+        """Record parameters for key, plus a copy of the output file if given."""
+        meta_path, out_path = self._paths(key)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if output is not None:
+            self._atomic_copy(Path(output), out_path)
+
+        fd, tmp = tempfile.mkstemp(dir=meta_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+        # Only walk the whole tree when it might be over the limit
+        self._stores += 1
+        if self._estimate is not None:
+            with contextlib.suppress(OSError):
+                self._estimate += meta_path.stat().st_size + (out_path.stat().st_size if output is not None else 0)
+        if self._estimate is None or self._estimate > self.max_bytes or self._stores % SCAN_EVERY == 0:
+            self.evict()
+
+    def _atomic_copy(self, src: Path, dest: Path):
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+            raise
+
+    def _scan(self) -> tuple[int, list]:
+        """(total bytes, [(is parameters, mtime, size, path)]) of every finished entry."""
+        entries = []
+        total = 0
+        for folder in self.root.iterdir():
+            if not folder.is_dir():
+                continue
+            for f in folder.iterdir():
+                if f.suffix == ".tmp":
+                    continue  # another process's entry, still being written
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                total += st.st_size
+                entries.append((f.suffix != ".out", st.st_mtime, st.st_size, f))
+        return total, entries
+
+    def evict(self):
+        """Drop least-recently-used outputs (then parameters) until under max_bytes."""
+        # Scan without the lock; only a cache that is actually over the limit waits for it
+        total, _ = self._scan()
+        self._estimate = total
+        if total <= self.max_bytes:
+            return
+
+        with file_lock(self.root / ".lock"):
+            total, entries = self._scan()
+            # Outputs first (False sorts before True), oldest first
+            for _, _, size, f in sorted(entries, key=lambda e: (e[0], e[1])):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                with contextlib.suppress(OSError):
+                    f.unlink()
+                    total -= size
+            self._estimate = total
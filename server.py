@@ -0,0 +1,463 @@
+"""
+Local HTTP job service, so other programs on the machine can shrink media
+without shelling out to shrink.py.
+
+  python server.py [--port 8765] [--jobs N] [--threads 4] [--max-queue N]
+
+  POST   /jobs                {"path": "/abs/clip.mp4"}, or raw bytes with ?name=clip.mp4
+  GET    /jobs                every job the service remembers
+  GET    /jobs/<id>           status, output and timings of one job
+  GET    /jobs/<id>/events    progress events as NDJSON, streamed until the job ends
+  GET    /jobs/<id>/result    the shrunk file
+  DELETE /jobs/<id>           cancel a queued job or a running video
+  GET    /metrics             queue depth, CPU budget in use and per-job timings
+
+Jobs share one CPU budget like batch.py: a video costs --threads cores and
+runs process_video on a thread, an image costs one core and runs on the
+ImageEngine's worker processes. Once --max-queue jobs are waiting, new
+submissions get 503 with Retry-After. Path jobs write their output where
+batch.py would; uploads and their outputs live in a private work folder.
+The service binds to localhost and trusts its callers with any readable path.
+"""
+import argparse
+import functools
+import json
+import mimetypes
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import batch
+import image_engine
+import resources
+import shrink
+
+PORT = 8765
+HISTORY = 1000  # finished jobs kept for status/result requests
+MAX_UPLOAD_MB = 4096
+RETRY_AFTER_S = 5
+STREAM_KEEPALIVE_S = 15
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, path: Path, work_dir: Path | None = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.input = path
+        self.work_dir = work_dir  # only for uploads; removed when the job is forgotten
+        out_base = work_dir or path.parent
+        self.video_output = out_base / batch.video_output(path).name
+        self.image_output_dir = out_base / "output"
+        self.status = "queued"
+        self.output = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.cancel = threading.Event()
+
+    def timings(self) -> dict:
+        now = time.time()
+        return {
+            "queue_s": round((self.started or self.finished or now) - self.submitted, 3),
+            "run_s": round((self.finished or now) - self.started, 3) if self.started else None,
+        }
+
+    def to_dict(self) -> dict:
+        try:
+            output_size = Path(self.output).stat().st_size if self.status == "done" else None
+        except OSError:
+            output_size = None  # removed behind our back
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "input": str(self.input),
+            "status": self.status,
+            "output": str(self.output) if self.output else None,
+            "output_size": output_size,
+            "error": self.error,
+            "submitted": self.submitted,
+            **self.timings(),
+        }
+
+
+class JobService:
+    """
+    Queue plus worker pools behind the HTTP handler. Every state change happens
+    under one condition variable, which also wakes event streams.
+    """
+
+    def __init__(
+        self,
+        cores: int | None = None,
+        threads: int = 4,
+        max_queue: int | None = None,
+        work_dir=None,
+        history: int = HISTORY,
+        image_executor_cls=ProcessPoolExecutor,
+    ):
+        self.cores = cores or resources.available_cpus()
+        self.threads = max(1, min(threads, self.cores))
+        self.max_queue = max_queue or 4 * self.cores
+        self.history = history
+        self._own_work_dir = work_dir is None
+        self.work_dir = Path(work_dir or tempfile.mkdtemp(prefix="shrink_server_"))
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+
+        self.jobs = OrderedDict()
+        self.queue = deque()
+        self.budget = self.cores
+        self.counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self.started = time.time()
+        self.closing = False
+        self.cond = threading.Condition()
+
+        self._videos = ThreadPoolExecutor(max_workers=max(1, self.cores // self.threads), thread_name_prefix="video")
+        self._images = image_engine.ImageEngine(workers=self.cores, executor_cls=image_executor_cls)
+
+    def _check_capacity(self):
+        if len(self.queue) >= self.max_queue:
+            self.counts["rejected"] += 1
+            raise Overloaded(f"{len(self.queue)} jobs already queued")
+
+    def check_capacity(self):
+        with self.cond:
+            self._check_capacity()
+
+    def submit_path(self, path) -> Job:
+        path = Path(path).resolve()
+        if not path.is_file():
+            raise FileNotFoundError(f"Input not found: {path}")
+        return self._add(Job(self._kind(path), path))
+
+    def submit_upload(self, name: str, body, length: int) -> Job:
+        """Store `length` bytes from the body stream as `name` and queue it."""
+        name = Path(name).name
+        self._kind(Path(name))
+        self.check_capacity()  # before spending time on the upload
+        work_dir = Path(tempfile.mkdtemp(prefix="job_", dir=self.work_dir))
+        path = work_dir / name
+        try:
+            with open(path, "wb") as f:
+                remaining = length
+                while remaining:
+                    chunk = body.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ValueError(f"Upload ended after {length - remaining} of {length} bytes")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            return self._add(Job(self._kind(path), path, work_dir))
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def _kind(path: Path) -> str:
+        kind = batch.file_kind(path)
+        if kind is None:
+            raise ValueError(f"Not a supported video or image (or already shrunk): {path.name}")
+        return kind
+
+    def _add(self, job: Job) -> Job:
+        with self.cond:
+            self._check_capacity()
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            self.counts["submitted"] += 1
+            self._emit(job, "queued", kind=job.kind, position=len(self.queue))
+            self._fill()
+        return job
+
+    def _emit(self, job: Job, event: str, **fields):
+        self._on_event(job, {"event": event, "time": round(time.time(), 3), "input": str(job.input), **fields})
+
+    def _on_event(self, job: Job, record: dict):
+        with self.cond:
+            job.events.append(record)
+            self.cond.notify_all()
+
+    def _fill(self):
+        # Strictly in order: a video waiting for cores is not overtaken by images
+        while self.queue and not self.closing:
+            job = self.queue[0]
+            cost = batch.job_cost(job.kind, self.threads)
+            if cost > self.budget:
+                return
+            if job.kind == "image":
+                future = self._images.try_submit(job.input, job.image_output_dir)
+                if future is None:
+                    return  # over the memory budget until a running image finishes
+                self._emit(job, "job_start", output=str(job.image_output_dir))
+            else:
+                future = self._videos.submit(self._run_video, job)
+            self.queue.popleft()
+            self.budget -= cost
+            job.status = "running"
+            job.started = time.time()
+            future.add_done_callback(functools.partial(self._finished, job, cost))
+
+    def _run_video(self, job: Job) -> str:
+        # process_video emits its own job_start/job_end events
+        return shrink.process_video(
+            str(job.input), str(job.video_output), self.threads,
+            on_event=functools.partial(self._on_event, job), cancel=job.cancel,
+        )
+
+    def _finished(self, job: Job, cost: int, future):
+        try:
+            result = future.result()
+        except CancelledError:
+            # Dropped by a pool shutdown (ImageEngine.close, shutdown(cancel_futures=True))
+            status, output, error = "cancelled", None, "cancelled"
+        except BaseException as e:  # anything, so the job's budget is always returned
+            status, output, error = ("cancelled" if job.cancel.is_set() else "failed"), None, str(e) or type(e).__name__
+        else:
+            status, output, error = "done", result if job.kind == "video" else result["output"], None
+
+        with self.cond:
+            self.budget += cost
+            job.status, job.output, job.error = status, output, error
+            job.finished = time.time()
+            self.counts[status] += 1
+            if job.kind == "image":
+                self._emit(job, "job_end", status=status, output=output, error=error, elapsed=job.timings()["run_s"])
+            self._fill()
+            self._forget_old()
+            self.cond.notify_all()
+
+    def _forget_old(self):
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        for job in finished[: max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+            if job.work_dir is not None:
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def get(self, job_id: str) -> Job | None:
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list[Job]:
+        with self.cond:
+            return list(self.jobs.values())
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel a queued job or a running video; False if it can no longer be stopped."""
+        with self.cond:
+            if job in self.queue:
+                self.queue.remove(job)
+                job.status, job.error, job.finished = "cancelled", "cancelled", time.time()
+                self.counts["cancelled"] += 1
+                self._emit(job, "job_end", status="cancelled")
+                self._fill()
+                return True
+            if job.status == "running" and job.kind == "video":
+                job.cancel.set()
+                return True
+            return False
+
+    def stream(self, job: Job):
+        """Yield lists of new events (possibly empty, as keepalives) until the job has finished."""
+        sent = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(job.events) > sent or job.finished is not None, STREAM_KEEPALIVE_S)
+                new = job.events[sent:]
+                done = job.finished is not None
+            sent += len(new)
+            yield new
+            if done:
+                return
+
+    def metrics(self) -> dict:
+        with self.cond:
+            jobs = list(self.jobs.values())
+            finished = [job for job in jobs if job.finished is not None and job.started is not None]
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "cores": self.cores,
+                "threads_per_video": self.threads,
+                "cores_in_use": self.cores - self.budget,
+                "queue_depth": len(self.queue),
+                "max_queue": self.max_queue,
+                "running": sum(job.status == "running" for job in jobs),
+                "counts": dict(self.counts),
+                "mean_queue_s": round(sum(j.timings()["queue_s"] for j in finished) / len(finished), 3) if finished else None,
+                "mean_run_s": round(sum(j.timings()["run_s"] for j in finished) / len(finished), 3) if finished else None,
+                "jobs": [{"id": job.id, "kind": job.kind, "status": job.status, **job.timings()} for job in jobs],
+            }
+
+    def close(self):
+        """Drop queued jobs, cancel running videos and wait for the pools to stop."""
+        with self.cond:
+            self.closing = True
+            for job in list(self.queue):
+                self.cancel(job)
+            for job in self.jobs.values():
+                if job.status == "running":
+                    job.cancel.set()
+        self._videos.shutdown(wait=True)
+        self._images.close()
+        if self._own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    service: JobService = None
+    max_upload = MAX_UPLOAD_MB * 1024 * 1024
+
+    def _send_json(self, status, obj, headers=None):
+        body = (json.dumps(obj) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _route(self):
+        """(job or None, sub-resource) for /jobs/<id>[/<sub>]; job is None if unknown."""
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "jobs":
+            return None, None
+        return self.service.get(parts[1]), parts[2] if len(parts) > 2 else ""
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/metrics":
+            return self._send_json(HTTPStatus.OK, self.service.metrics())
+        if path == "/jobs":
+            return self._send_json(HTTPStatus.OK, [job.to_dict() for job in self.service.list_jobs()])
+
+        job, sub = self._route()
+        if job is None:
+            return self._error(HTTPStatus.NOT_FOUND, "no such job")
+        if sub == "":
+            return self._send_json(HTTPStatus.OK, job.to_dict())
+        if sub == "events":
+            return self._stream_events(job)
+        if sub == "result":
+            return self._send_result(job)
+        return self._error(HTTPStatus.NOT_FOUND, f"unknown resource {sub!r}")
+
+    def _stream_events(self, job: Job):
+        # HTTP/1.0 response without Content-Length: the body ends when we close
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for events in self.service.stream(job):
+                for event in events:
+                    self.wfile.write((json.dumps(event) + "\n").encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_result(self, job: Job):
+        if job.status != "done":
+            return self._error(HTTPStatus.CONFLICT, f"job is {job.status}")
+        out = Path(job.output)
+        try:
+            f = open(out, "rb")
+        except OSError as e:
+            return self._error(HTTPStatus.GONE, str(e))
+        with f:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", mimetypes.guess_type(out.name)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(out.stat().st_size))
+            self.send_header("Content-Disposition", f'attachment; filename="{out.name}"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._error(HTTPStatus.NOT_FOUND, "POST to /jobs")
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self._error(HTTPStatus.LENGTH_REQUIRED, "Content-Length required")
+
+        try:
+            if self.headers.get_content_type() == "application/json":
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict) or not request.get("path"):
+                    return self._error(HTTPStatus.BAD_REQUEST, 'expected {"path": ...}')
+                job = self.service.submit_path(request["path"])
+            else:
+                name = parse_qs(url.query).get("name", [""])[0]
+                if not name:
+                    return self._error(HTTPStatus.BAD_REQUEST, "uploads need ?name=<file name>")
+                if length > self.max_upload:
+                    return self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"uploads are limited to {self.max_upload} bytes")
+                job = self.service.submit_upload(name, self.rfile, length)
+        except Overloaded as e:
+            return self._error(HTTPStatus.SERVICE_UNAVAILABLE, f"overloaded: {e}", {"Retry-After": str(RETRY_AFTER_S)})
+        except FileNotFoundError as e:
+            return self._error(HTTPStatus.NOT_FOUND, str(e))
+        except ValueError as e:
+            return self._error(HTTPStatus.BAD_REQUEST, str(e))
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        job, sub = self._route()
+        if job is None or sub != "":
+            return self._error(HTTPStatus.NOT_FOUND, "no such job")
+        if not self.service.cancel(job):
+            return self._error(HTTPStatus.CONFLICT, f"cannot cancel a {job.status} {job.kind} job")
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def log_request(self, code="-", size="-"):
+        # Event streams and polling are chatty; only errors are worth a line
+        if isinstance(code, int) and code >= 400:
+            super().log_request(code, size)
+
+
+def make_server(service: JobService, host: str = "127.0.0.1", port: int = PORT) -> ThreadingHTTPServer:
+    """HTTP server bound to host:port (port 0 picks a free one) serving `service`."""
+    handler = type("BoundHandler", (Handler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve the shrinker as a local HTTP job queue.")
+    ap.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    ap.add_argument("--port", type=int, default=PORT, help=f"Port (default: {PORT})")
+    ap.add_argument("--threads", type=int, default=4, help="FFmpeg threads per video job (default: 4)")
+    ap.add_argument("--jobs", type=int, help="CPU budget shared by all jobs (default: usable cores)")
+    ap.add_argument("--max-queue", type=int, help="Waiting jobs before submissions get 503 (default: 4 x --jobs)")
+    ap.add_argument("--work-dir", help="Folder for uploads and their outputs (default: a temp folder)")
+    args = ap.parse_args()
+
+    service = JobService(cores=args.jobs, threads=args.threads, max_queue=args.max_queue, work_dir=args.work_dir)
+    server = make_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} | {service.cores} cores, {service.threads} threads per video")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down; cancelling running jobs...")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 import argparse
+import asyncio
+import json
 import os
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
+import result_cache
+
 TARGET_MB = 9.5
 TARGET_BYTES = int(TARGET_MB * 1024 * 1024)
 SAFETY_FACTOR = 0.95
@@ -24,26 +32,454 @@ DOWNSCALE_WIDTHS = [1280, 960, 854, 640]
 # Legacy strategy fallback (old behavior): start with no scale, then downscale
 LEGACY_DOWNSCALE_STEPS = [None, 1280, 960, 854, 640]
 
+# Ladder planner: minimum bits-per-pixel we consider "acceptable quality" per codec.
+# Rungs below this are skipped when predicting where the ladder should start.
+MIN_BITS_PER_PIXEL = {
+    "libx265": 0.035,
+    "libx264": 0.06,
+}
+
+# Floor applied by compute_target_kbps; a rung whose budget is clamped to it will overshoot.
+MIN_VIDEO_KBPS = 80
+
+# Pass-2 early abort: once this fraction of the clip is encoded, kill the encode
+# if the projected final size exceeds TARGET_BYTES by more than ABORT_OVERSHOOT.
+ABORT_MIN_PROGRESS = 0.2
+ABORT_OVERSHOOT = 1.08
+
+
+# Optional sample probe: encode a few short segments spread across the clip at
+# the codec's quality-floor CRF and extrapolate the full-length size. Content
+# that overshoots even there cannot fit at the rung's bitrate without dropping
+# below that quality, so the rung is skipped before paying for a 2-pass encode.
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 4
+SAMPLE_MIN_DURATION = 60  # shorter clips are cheap enough to encode directly
+SAMPLE_REJECT_MARGIN = 1.05  # skip rungs whose floor estimate exceeds target by this factor
+
+
+# Pass-1 stats are reused for a rung with the same filter graph when the video
+# bitrate is within this fraction of the one pass 1 ran at (x264/x265 rescale
+# first-pass stats to the pass-2 bitrate).
+PASS1_REUSE_TOLERANCE = 0.25
+
+# Fast paths: codecs that can be stream-copied into an MP4 without re-encoding
+MP4_VIDEO_CODECS = {"h264", "hevc", "av1", "mpeg4"}
+MP4_AUDIO_CODECS = {"aac", "mp3"}
+
+# Chunked engine: split at keyframes, encode chunks in parallel, concat losslessly.
+# Chunks shorter than this cost more in rate-control warmup than they gain.
+CHUNK_MIN_SECONDS = 20
+
+ENGINES = ("2pass", "chunked")
+
+# Per-job scratch directories are created under this directory if set (e.g. /dev/shm)
+SCRATCH_ENV = "SHRINK_SCRATCH"
+
+# CRF rate control: binary-search the CRF on uncapped sample encodes, then encode
+# once with a VBV cap at the rung's video bitrate, so the encode cannot run far
+# past the budget. Content that overshoots even at the top of CRF_RANGE goes
+# straight to 2-pass, and that verdict (or the CRF found) carries down the ladder.
+RATE_CONTROLS = ("2pass", "crf")
+CRF_RANGE = {
+    "libx265": (18, 36),
+    "libx264": (16, 34),
+}
+CRF_MAXRATE_FACTOR = 1.0
+
+# A stopped ffmpeg gets this long to exit after SIGTERM before it is killed
+STOP_GRACE_S = 5
+
+
+class EncodeAborted(RuntimeError):
+    """An ffmpeg run was stopped before completion (e.g. projected to overshoot)."""
+
+
+class EventLog:
+    """
+    Structured events of one process_video call, delivered to an on_event
+    callback and/or appended as JSON lines to a metrics file. Every event is a
+    dict with "event", "time" (epoch seconds) and "input"; emit() is thread-safe.
+    """
+
+    def __init__(self, infile: Path, on_event=None, metrics_path=None):
+        self.infile = str(infile)
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._fh = open(metrics_path, "a", encoding="utf-8") if metrics_path else None
+
+    def emit(self, event: str, **fields):
+        record = {"event": event, "time": round(time.time(), 3), "input": self.infile, **fields}
+        with self._lock:
+            if self._fh is not None:
+                self._fh.write(json.dumps(record) + "\n")
+                self._fh.flush()
+            if self.on_event is not None:
+                self.on_event(record)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class EncodeJob:
+    """
+    State shared by every ladder attempt of one process_video call.
+    Keeps pass-1 passlogs alive so later rungs can skip straight to pass 2, and
+    encodes each distinct audio bitrate once so attempts can mux it with -c:a copy.
+    Attempts report progress through the job's EventLog, if it has one.
+    All attempts run on one event loop, so only waits across an ffmpeg run
+    need a lock. Call close() when the job is finished to remove everything it kept.
+    """
+
+    def __init__(
+        self,
+        infile: Path,
+        workdir: Path,
+        stem: str,
+        audio: bool | None = None,
+        events: EventLog | None = None,
+    ):
+        self.infile = infile
+        self.workdir = workdir
+        self.stem = stem
+        self.events = events
+        self._pass1 = {}  # key -> [(video_kbps, passlog), ...]
+        self._pass1_locks = {}
+        self._counter = 0
+        self._has_audio = audio  # None: probe on first use
+        self._audio = {}  # audio_kbps -> side file
+        self._audio_locks = {}
+        self._crf = {}  # codec -> CRF settled on an earlier rung, or None if none fit
+
+    def temp_path(self, name: str) -> Path:
+        """Path for a job-owned temp file in the job's scratch directory."""
+        return self.workdir / f"{self.stem}__{name}"
+
+    def attempt_label(self, path: Path) -> str:
+        """Short name of the attempt writing to a temp output, e.g. "libx265_fps30_a64"."""
+        return path.stem.removeprefix(self.stem + "__")
+
+    def emit(self, event: str, **fields):
+        if self.events is not None:
+            self.events.emit(event, **fields)
+
+    def progress(self, attempt: str, stage: str, duration_s: float, check=None):
+        """run_progress callback: emit a "progress" event, then run check (e.g. overshoot_guard)."""
+        def report(stats):
+            if self.events is not None:
+                self.emit("progress", attempt=attempt, stage=stage, **progress_fields(stats, duration_s))
+            if check is not None:
+                check(stats)
+        return report
+
+    async def pass1_stats(self, key: tuple, video_kbps: int, produce) -> str:
+        """
+        Return a passlog base for key whose bitrate is close to video_kbps.
+        On a miss, await produce(passlog) runs pass 1 and the result is cached.
+        Concurrent callers with the same key wait instead of duplicating pass 1.
+        """
+        key_lock = self._pass1_locks.setdefault(key, asyncio.Lock())
+
+        async with key_lock:
+            passlog = self.find_pass1(key, video_kbps)
+            if passlog is not None:
+                return passlog
+
+            passlog = self.new_passlog()
+            try:
+                await produce(passlog)
+            except BaseException:
+                cleanup_passlog_set(passlog)
+                raise
+            self.store_pass1(key, video_kbps, passlog)
+            return passlog
+
+    def find_pass1(self, key: tuple, video_kbps: int) -> str | None:
+        """Cached passlog for key within PASS1_REUSE_TOLERANCE of video_kbps, or None."""
+        for kbps, passlog in self._pass1.get(key, []):
+            if abs(kbps - video_kbps) <= video_kbps * PASS1_REUSE_TOLERANCE:
+                print(f"Reusing pass-1 stats ({kbps}k) for {video_kbps}k")
+                return passlog
+        return None
 
-def run(cmd):
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    def new_passlog(self) -> str:
+        self._counter += 1
+        return str(self.temp_path(f"pass1_{self._counter}.passlog"))
+
+    def store_pass1(self, key: tuple, video_kbps: int, passlog: str):
+        """Add a finished pass-1 passlog to the cache; close() removes it."""
+        self._pass1.setdefault(key, []).append((video_kbps, passlog))
+
+    def known_crf(self, codec: str) -> tuple[bool, int | None]:
+        """(True, CRF or None) if an earlier rung settled the CRF for codec, else (False, None)."""
+        if codec in self._crf:
+            return True, self._crf[codec]
+        return False, None
+
+    def settle_crf(self, codec: str, crf: int | None):
+        """
+        Record the CRF later rungs should use, or None if CRF did not work out.
+        Later rungs are cheaper, so a CRF that fit here still fits there, and
+        content that overshot at the top of CRF_RANGE is unlikely to come close.
+        """
+        self._crf[codec] = crf
+
+    async def audio_track(self, audio_kbps: int, cancel: threading.Event | None = None) -> Path | None:
+        """
+        Return the source audio encoded once as AAC at audio_kbps (None if the
+        source has no audio). Concurrent callers share a single encode.
+        """
+        if self._has_audio is None:
+            self._has_audio = has_audio(await probe_media(self.infile))
+        key_lock = self._audio_locks.setdefault(audio_kbps, asyncio.Lock())
+
+        if not self._has_audio:
+            return None
+
+        async with key_lock:
+            if audio_kbps in self._audio:
+                return self._audio[audio_kbps]
+
+            path = self.temp_path(f"audio_{audio_kbps}k.m4a")
+            cmd = [
+                "ffmpeg", "-y", "-i", str(self.infile),
+                "-map", "0:a:0",
+                "-c:a", "aac",
+                "-b:a", f"{audio_kbps}k",
+                str(path),
+            ]
+            try:
+                await run_progress(cmd, cancel=cancel)
+            except BaseException:
+                path.unlink(missing_ok=True)
+                raise
+            self._audio[audio_kbps] = path
+            return path
+
+    def close(self):
+        for entries in self._pass1.values():
+            for _, passlog in entries:
+                cleanup_passlog_set(passlog)
+        self._pass1.clear()
+
+        for path in self._audio.values():
+            path.unlink(missing_ok=True)
+        self._audio.clear()
+
+
+async def run(cmd) -> subprocess.CompletedProcess:
+    """Run cmd to completion; RuntimeError with stderr on failure. Cancelling stops it."""
+    p = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await p.communicate()
+    except BaseException:
+        await stop_process(p)
+        raise
+    stdout, stderr = stdout.decode(errors="replace"), stderr.decode(errors="replace")
     if p.returncode != 0:
-        raise RuntimeError(p.stderr.strip())
-    return p
+        raise RuntimeError(stderr.strip())
+    return subprocess.CompletedProcess(cmd, p.returncode, stdout, stderr)
+
+
+async def run_progress(cmd, on_progress=None, cancel: threading.Event | None = None) -> subprocess.CompletedProcess:
+    """
+    Run an ffmpeg command with machine-readable progress on stdout.
+    on_progress(stats) is called for every progress block with ffmpeg's
+    key=value pairs (out_time_us, total_size, fps, speed, progress, ...).
+    If on_progress raises, ffmpeg is stopped and the exception propagates.
+    If cancel is set while running, ffmpeg is stopped and EncodeAborted is raised;
+    cancelling the awaiting task stops it too.
+    """
+    cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    p = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+    # Drain stderr concurrently so ffmpeg never blocks on a full pipe
+    stderr_tail = deque(maxlen=50)
+
+    async def drain():
+        async for line in p.stderr:
+            stderr_tail.append(line.decode(errors="replace"))
+
+    reader = asyncio.ensure_future(drain())
+
+    stats = {}
+    try:
+        async for line in p.stdout:
+            if cancel is not None and cancel.is_set():
+                raise EncodeAborted("cancelled")
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            stats[key] = value
+            if key == "progress":
+                if on_progress:
+                    on_progress(stats)
+                stats = {}
+        returncode = await p.wait()
+        await reader
+    except BaseException:
+        reader.cancel()
+        await stop_process(p)
+        raise
+
+    if returncode != 0:
+        raise RuntimeError("".join(stderr_tail).strip())
+    return subprocess.CompletedProcess(cmd, returncode)
+
+
+async def stop_process(p: asyncio.subprocess.Process):
+    """
+    Terminate p (ffmpeg exits cleanly on SIGTERM) and wait for it. It is killed
+    after STOP_GRACE_S, or at once if the waiting task is cancelled meanwhile.
+    """
+    if p.returncode is not None:
+        return
+    try:
+        p.terminate()
+        await asyncio.wait_for(asyncio.shield(p.wait()), STOP_GRACE_S)
+    except (ProcessLookupError, asyncio.TimeoutError):
+        pass
+    finally:
+        if p.returncode is None:
+            try:
+                p.kill()
+            except ProcessLookupError:
+                pass
+            await asyncio.shield(p.wait())
+
+
+def progress_fields(stats: dict, duration_s: float) -> dict:
+    """
+    Decode one ffmpeg progress block into percent, fps, speed, size and
+    projected_size; fields ffmpeg reports as "N/A" are left out.
+    """
+    fields = {}
+    try:
+        done = int(stats["out_time_us"]) / 1_000_000 / max(duration_s, 0.1)
+        fields["percent"] = round(min(done, 1.0) * 100, 1)
+    except (KeyError, ValueError):
+        done = None
+    try:
+        fields["fps"] = float(stats["fps"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        fields["speed"] = float(stats["speed"].rstrip("x"))
+    except (KeyError, ValueError):
+        pass
+    try:
+        fields["size"] = int(stats["total_size"])
+    except (KeyError, ValueError):
+        pass
+    if done and fields.get("size"):
+        fields["projected_size"] = int(fields["size"] / min(done, 1.0))
+    return fields
+
+
+def overshoot_guard(duration_s: float):
+    """Progress callback that aborts once the projected output size is clearly over target."""
+    def check(stats):
+        try:
+            out_s = int(stats.get("out_time_us")) / 1_000_000
+            size = int(stats.get("total_size"))
+        except (TypeError, ValueError):
+            return  # "N/A" early in the encode
+
+        done = out_s / max(duration_s, 0.1)
+        if done < ABORT_MIN_PROGRESS:
+            return
+
+        projected = size / done
+        if projected > TARGET_BYTES * ABORT_OVERSHOOT:
+            raise EncodeAborted(
+                f"projected {projected / (1024 * 1024):.2f} MB at {done:.0%} exceeds target"
+            )
+    return check
 
 
 def ffmpeg_exists():
     return shutil.which("ffmpeg") and shutil.which("ffprobe")
 
 
-def get_duration_seconds(infile: Path) -> float:
+async def probe_media(infile: Path) -> dict:
+    """
+    Single up-front ffprobe of the input: ffprobe's JSON with "format" and "streams".
+    Everything else (duration, video metadata, audio presence, fast-path
+    decisions) is derived from this instead of probing again.
+    """
     cmd = [
         "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
+        "-show_format",
+        "-show_streams",
+        "-of", "json",
         str(infile)
     ]
-    return float(run(cmd).stdout.strip())
+    try:
+        return json.loads((await run(cmd)).stdout)
+    except ValueError as e:
+        raise RuntimeError(f"ffprobe returned unreadable output for {infile}: {e}")
+
+
+def media_duration(info: dict) -> float:
+    try:
+        return float(info["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        raise RuntimeError("ffprobe could not determine the duration")
+
+
+def first_stream(info: dict, codec_type: str) -> dict | None:
+    for stream in info.get("streams") or []:
+        if stream.get("codec_type") != codec_type:
+            continue
+        # Cover art is reported as a video stream; it is not the video
+        if stream.get("disposition", {}).get("attached_pic"):
+            continue
+        return stream
+    return None
+
+
+def has_audio(info: dict) -> bool:
+    return first_stream(info, "audio") is not None
+
+
+def parse_rate(rate: str) -> float | None:
+    # ffprobe reports frame rates as fractions, e.g. "30000/1001"
+    try:
+        num, _, den = rate.partition("/")
+        value = float(num) / float(den or 1)
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+    return value if value > 0 else None
+
+
+def stream_bit_rate(stream: dict | None) -> int | None:
+    try:
+        return int(stream["bit_rate"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def video_meta(info: dict) -> dict:
+    """
+    Return metadata for the first video stream:
+      {"width", "height", "fps", "bit_rate"}
+    bit_rate is the container bitrate in bits/s (None if unknown).
+    Returns an empty dict if there is no video stream.
+    """
+    stream = first_stream(info, "video")
+    if stream is None:
+        return {}
+
+    return {
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "fps": parse_rate(stream.get("avg_frame_rate")) or parse_rate(stream.get("r_frame_rate")),
+        "bit_rate": stream_bit_rate(info.get("format")),
+    }
 
 
 def build_vf(scale_width=None, fps=None):
@@ -56,14 +492,33 @@ def build_vf(scale_width=None, fps=None):
     return ",".join(filters) if filters else None
 
 
-def cleanup_pass_files_everywhere(folder: Path):
-    # Clean up any ffmpeg 2-pass artifacts that might remain
-    for pat in ("*.log*", "*.mbtree", "*.passlog*"):
-        for f in folder.glob(pat):
-            try:
-                f.unlink()
-            except Exception:
-                pass
+def make_scratch_dir(base, stem: str) -> Path:
+    """Create a private scratch directory for one job under base (e.g. /dev/shm)."""
+    base = Path(base)
+    base.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f".{stem}__scratch_", dir=base))
+
+
+def move_into_place(src: Path, dest: Path):
+    """
+    Atomically replace dest with src. Across filesystems (e.g. a tmpfs scratch),
+    src is copied to a temp file next to dest first, then renamed over it.
+    """
+    try:
+        os.replace(src, dest)
+        return
+    except OSError:
+        pass  # EXDEV or Windows' cross-drive equivalent
+
+    fd, tmp = tempfile.mkstemp(prefix=f".{dest.name}.", suffix=".tmp", dir=dest.parent)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    src.unlink(missing_ok=True)
 
 
 def cleanup_passlog_set(passlog_base: str):
@@ -83,19 +538,26 @@ def cleanup_passlog_set(passlog_base: str):
             pass
 
 
-def compute_target_kbps(duration_s: float, audio_kbps: int) -> tuple[int, int]:
-    """Return (video_kbps, audio_kbps) for target size."""
+def compute_target_kbps(duration_s: float, audio_kbps: int, audio_bytes: int | None = None) -> tuple[int, int]:
+    """
+    Return (video_kbps, audio_kbps) for target size.
+    If audio_bytes is given (an already-encoded audio track, 0 for none), the
+    video budget is whatever that track leaves instead of the nominal audio kbps.
+    """
     total_bits = TARGET_BYTES * 8 * SAFETY_FACTOR
     total_bps = total_bits / max(duration_s, 0.1)
 
-    audio_bps = audio_kbps * 1000
+    if audio_bytes is not None:
+        audio_bps = audio_bytes * 8 / max(duration_s, 0.1)
+    else:
+        audio_bps = audio_kbps * 1000
     # Avoid absurdly low video bitrate; if too long, quality will degrade regardless.
-    video_bps = max(int(total_bps - audio_bps), 80_000)
+    video_bps = max(int(total_bps - audio_bps), MIN_VIDEO_KBPS * 1000)
 
     return int(video_bps / 1000), int(audio_kbps)
 
 
-def encode_2pass(
+async def encode_2pass(
     infile: Path,
     outfile: Path,
     duration_s: float,
@@ -106,45 +568,71 @@ def encode_2pass(
     scale_width=None,
     legacy_rate_control: bool = False,
     threads: int = 4,
+    cancel: threading.Event | None = None,
+    job: "EncodeJob | None" = None,
 ) -> str:
     """
     2-pass encode to target size.
     If legacy_rate_control=True, adds maxrate/bufsize (old script style).
+    If cancel is set, the running pass is killed and EncodeAborted is raised.
+    If job is given, pass-1 stats are taken from (and stored in) its cache, and
+    the job's pre-encoded audio track is muxed in with -c:a copy; job-owned
+    passlogs must not be deleted by the caller, and both passes report progress
+    events to the job.
     Returns passlog base path.
     """
-    v_k, a_k = compute_target_kbps(duration_s, audio_kbps)
-    passlog = str(outfile) + ".passlog"
+    attempt = job.attempt_label(outfile) if job is not None else None
+    audio = None
+    if job is not None:
+        audio = await job.audio_track(audio_kbps, cancel=cancel)
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps, audio.stat().st_size if audio else 0)
+    else:
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps)
     vf = build_vf(scale_width=scale_width, fps=fps)
 
     # Windows null sink for pass 1
     null_sink = "NUL" if os.name == "nt" else "/dev/null"
 
     # PASS 1
-    cmd1 = ["ffmpeg", "-y", "-i", str(infile)]
-    if vf:
-        cmd1 += ["-vf", vf]
-
-    cmd1 += [
-        "-c:v", codec,
-        "-preset", preset,
-        "-b:v", f"{v_k}k",
-        "-threads", str(threads),
-    ]
-
-    if legacy_rate_control:
-        cmd1 += ["-maxrate", f"{int(v_k * 1.2)}k", "-bufsize", f"{int(v_k * 2)}k"]
-
-    cmd1 += [
-        "-pass", "1",
-        "-passlogfile", passlog,
-        "-an",
-        "-f", "mp4",
-        null_sink,  # output MUST be last
-    ]
-    run(cmd1)
+    async def run_pass1(passlog):
+        cmd1 = ["ffmpeg", "-y", "-i", str(infile)]
+        if vf:
+            cmd1 += ["-vf", vf]
+
+        cmd1 += [
+            "-c:v", codec,
+            "-preset", preset,
+            "-b:v", f"{v_k}k",
+            "-threads", str(threads),
+        ]
+
+        if legacy_rate_control:
+            cmd1 += ["-maxrate", f"{int(v_k * 1.2)}k", "-bufsize", f"{int(v_k * 2)}k"]
+
+        cmd1 += [
+            "-pass", "1",
+            "-passlogfile", passlog,
+            "-an",
+            "-f", "mp4",
+            null_sink,  # output MUST be last
+        ]
+        on_progress = job.progress(attempt, "pass1", duration_s) if job is not None else None
+        await run_progress(cmd1, on_progress=on_progress, cancel=cancel)
+
+    if job is not None:
+        # Rungs that differ only in audio bitrate share the same video filter graph
+        key = (codec, preset, fps, scale_width, legacy_rate_control)
+        passlog = await job.pass1_stats(key, v_k, run_pass1)
+    else:
+        passlog = str(outfile) + ".passlog"
+        await run_pass1(passlog)
 
     # PASS 2
     cmd2 = ["ffmpeg", "-y", "-i", str(infile)]
+    if audio:
+        cmd2 += ["-i", str(audio), "-map", "0:v:0", "-map", "1:a:0"]
+    elif job is not None:
+        cmd2 += ["-map", "0:v:0"]
     if vf:
         cmd2 += ["-vf", vf]
 
@@ -158,133 +646,1215 @@ def encode_2pass(
     if legacy_rate_control:
         cmd2 += ["-maxrate", f"{int(v_k * 1.2)}k", "-bufsize", f"{int(v_k * 2)}k"]
 
-    cmd2 += [
-        "-pass", "2",
-        "-passlogfile", passlog,
-        "-c:a", "aac",
-        "-b:a", f"{a_k}k",
-        "-movflags", "+faststart",
-    ]
+    cmd2 += ["-pass", "2", "-passlogfile", passlog]
+    if job is None:
+        cmd2 += ["-c:a", "aac", "-b:a", f"{a_k}k"]
+    elif audio:
+        cmd2 += ["-c:a", "copy"]
+    cmd2 += ["-movflags", "+faststart"]
 
     # HEVC tag in MP4 for compatibility (helps some Apple/QuickTime players)
     if codec == "libx265":
         cmd2 += ["-tag:v", "hvc1"]
 
     cmd2 += [str(outfile)]  # output MUST be last
-    run(cmd2)
+    # Watch the growing output and give up as soon as it is clearly going to miss
+    on_progress = overshoot_guard(duration_s)
+    if job is not None:
+        on_progress = job.progress(attempt, "pass2", duration_s, check=on_progress)
+    await run_progress(cmd2, on_progress=on_progress, cancel=cancel)
 
     return passlog
 
 
-def attempt_encode(
+def crf_vbv_args(video_kbps: int) -> list[str]:
+    maxrate = int(video_kbps * CRF_MAXRATE_FACTOR)
+    return ["-maxrate", f"{maxrate}k", "-bufsize", f"{maxrate * 2}k"]
+
+
+async def encode_crf(
     infile: Path,
     outfile: Path,
     duration_s: float,
     codec: str,
     preset: str,
     audio_kbps: int,
+    crf: int,
+    fps=None,
+    scale_width=None,
+    threads: int = 4,
+    cancel: threading.Event | None = None,
+    job: "EncodeJob | None" = None,
+):
+    """
+    Single-pass constant-quality encode with a capped VBV (see crf_vbv_args).
+    Audio is handled as in encode_2pass. Raises EncodeAborted as soon as the
+    projected size clearly overshoots, or if cancel is set.
+    """
+    attempt = job.attempt_label(outfile) if job is not None else None
+    audio = None
+    if job is not None:
+        audio = await job.audio_track(audio_kbps, cancel=cancel)
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps, audio.stat().st_size if audio else 0)
+    else:
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps)
+    vf = build_vf(scale_width=scale_width, fps=fps)
+
+    cmd = ["ffmpeg", "-y", "-i", str(infile)]
+    if audio:
+        cmd += ["-i", str(audio), "-map", "0:v:0", "-map", "1:a:0"]
+    elif job is not None:
+        cmd += ["-map", "0:v:0"]
+    if vf:
+        cmd += ["-vf", vf]
+
+    cmd += [
+        "-c:v", codec,
+        "-preset", preset,
+        "-crf", str(crf),
+        *crf_vbv_args(v_k),
+        "-threads", str(threads),
+    ]
+    if job is None:
+        cmd += ["-c:a", "aac", "-b:a", f"{a_k}k"]
+    elif audio:
+        cmd += ["-c:a", "copy"]
+    cmd += ["-movflags", "+faststart"]
+    if codec == "libx265":
+        cmd += ["-tag:v", "hvc1"]
+    cmd += [str(outfile)]
+
+    on_progress = overshoot_guard(duration_s)
+    if job is not None:
+        on_progress = job.progress(attempt, "crf", duration_s, check=on_progress)
+    await run_progress(cmd, on_progress=on_progress, cancel=cancel)
+
+
+async def crf_search(
+    infile: Path,
+    tmp_base: Path,
+    duration_s: float,
+    codec: str,
+    preset: str,
+    audio_kbps: int,
     fps=None,
     scale_width=None,
+    threads: int = 4,
+    cancel: threading.Event | None = None,
+) -> int | None:
+    """
+    Lowest (best-quality) CRF in CRF_RANGE[codec] whose sample estimate fits
+    TARGET_BYTES * SAFETY_FACTOR; None if even the highest CRF is predicted to
+    overshoot. The highest CRF is probed first, so content that cannot fit costs
+    one round of samples; otherwise the rest of the range is binary-searched.
+    """
+    lo, hi = CRF_RANGE.get(codec, CRF_RANGE["libx264"])
+
+    async def fits(crf: int) -> bool:
+        est = await sample_estimate(
+            infile, tmp_base, duration_s,
+            codec, preset, audio_kbps,
+            fps=fps, scale_width=scale_width,
+            threads=threads,
+            cancel=cancel,
+            crf=crf,
+        )
+        print(f"CRF {crf} estimate {tmp_base.name}: {est['size'] / (1024 * 1024):.2f} MB")
+        return est["size"] <= TARGET_BYTES * SAFETY_FACTOR
+
+    if not await fits(hi):
+        return None
+    best, hi = hi, hi - 1
+    while lo <= hi:
+        crf = (lo + hi) // 2
+        if await fits(crf):
+            best, hi = crf, crf - 1
+        else:
+            lo = crf + 1
+    return best
+
+
+async def encode_multi(
+    infile: Path,
+    outfiles: list[Path],
+    duration_s: float,
+    rungs: list[tuple],
     legacy_rate_control: bool = False,
     threads: int = 4,
-) -> Path | None:
-    tmp_out = outfile.with_name(
+    cancel: threading.Event | None = None,
+    job: "EncodeJob | None" = None,
+):
+    """
+    2-pass encode of several rungs from a single decode: the source video is
+    split once in a filter graph and each branch gets its own fps/scale filters,
+    encoder settings and passlog. Each pass is one ffmpeg process whatever the
+    number of rungs. With a job, cached pass-1 stats are reused (pass 1 only
+    runs for rungs without them) and audio is muxed from the job's side files.
+    There is no early overshoot abort: progress covers all outputs at once.
+    """
+    n = len(rungs)
+    label = "+".join(job.attempt_label(o) for o in outfiles) if job is not None else None
+    null_sink = "NUL" if os.name == "nt" else "/dev/null"
+
+    plans = []  # (video args, audio file, audio kbps, pass-1 cache key, video kbps)
+    for codec, preset, fps, audio_kbps, scale_width in rungs:
+        audio = None
+        if job is not None:
+            audio = await job.audio_track(audio_kbps, cancel=cancel)
+            v_k, a_k = compute_target_kbps(duration_s, audio_kbps, audio.stat().st_size if audio else 0)
+        else:
+            v_k, a_k = compute_target_kbps(duration_s, audio_kbps)
+        video_args = ["-c:v", codec, "-preset", preset, "-b:v", f"{v_k}k", "-threads", str(threads)]
+        if legacy_rate_control:
+            video_args += ["-maxrate", f"{int(v_k * 1.2)}k", "-bufsize", f"{int(v_k * 2)}k"]
+        key = (codec, preset, fps, scale_width, legacy_rate_control)
+        plans.append((video_args, audio, a_k, key, v_k))
+
+    def split_graph(indices):
+        graph = f"[0:v]split={len(indices)}" + "".join(f"[s{k}]" for k in indices)
+        for k in indices:
+            _, _, fps, _, scale_width = rungs[k]
+            graph += f";[s{k}]{build_vf(scale_width=scale_width, fps=fps) or 'null'}[v{k}]"
+        return graph
+
+    passlogs = [None] * n
+    need = []  # rungs that get a pass-1 branch
+    for k, (_, _, _, key, v_k) in enumerate(plans):
+        if job is not None:
+            passlogs[k] = job.find_pass1(key, v_k)
+        if passlogs[k] is not None:
+            continue
+        # Rungs differing only in audio share one pass-1 branch, as in the job cache
+        twin = next(
+            (j for j in need if plans[j][3] == key and abs(plans[j][4] - v_k) <= v_k * PASS1_REUSE_TOLERANCE),
+            None,
+        )
+        if twin is not None:
+            passlogs[k] = passlogs[twin]
+        else:
+            passlogs[k] = job.new_passlog() if job is not None else str(outfiles[k]) + ".passlog"
+            need.append(k)
+
+    stored = False
+    try:
+        # PASS 1, only for rungs without cached stats
+        if need:
+            cmd1 = ["ffmpeg", "-y", "-i", str(infile), "-filter_complex", split_graph(need)]
+            for k in need:
+                cmd1 += ["-map", f"[v{k}]", *plans[k][0], "-pass", "1", "-passlogfile", passlogs[k]]
+                cmd1 += ["-an", "-f", "mp4", null_sink]
+            on_progress = job.progress(label, "pass1", duration_s) if job is not None else None
+            await run_progress(cmd1, on_progress=on_progress, cancel=cancel)
+            if job is not None:
+                for k in need:
+                    job.store_pass1(plans[k][3], plans[k][4], passlogs[k])
+                stored = True
+
+        # PASS 2: one input per distinct audio side file
+        cmd2 = ["ffmpeg", "-y", "-i", str(infile)]
+        audio_inputs = {}
+        for _, audio, _, _, _ in plans:
+            if audio and audio not in audio_inputs:
+                audio_inputs[audio] = len(audio_inputs) + 1
+                cmd2 += ["-i", str(audio)]
+        cmd2 += ["-filter_complex", split_graph(range(n))]
+
+        for k, (video_args, audio, a_k, _, _) in enumerate(plans):
+            cmd2 += ["-map", f"[v{k}]"]
+            if audio:
+                cmd2 += ["-map", f"{audio_inputs[audio]}:a:0"]
+            elif job is None:
+                cmd2 += ["-map", "0:a:0?"]
+            cmd2 += [*video_args, "-pass", "2", "-passlogfile", passlogs[k]]
+            if job is None:
+                cmd2 += ["-c:a", "aac", "-b:a", f"{a_k}k"]
+            elif audio:
+                cmd2 += ["-c:a", "copy"]
+            cmd2 += ["-movflags", "+faststart"]
+            if rungs[k][0] == "libx265":
+                cmd2 += ["-tag:v", "hvc1"]
+            cmd2 += [str(outfiles[k])]
+
+        on_progress = job.progress(label, "pass2", duration_s) if job is not None else None
+        await run_progress(cmd2, on_progress=on_progress, cancel=cancel)
+    except BaseException:
+        for out in outfiles:
+            out.unlink(missing_ok=True)
+        if job is not None and not stored:
+            for k in need:
+                cleanup_passlog_set(passlogs[k])
+        raise
+    finally:
+        if job is None:
+            for passlog in passlogs:
+                cleanup_passlog_set(passlog)
+
+
+async def split_at_keyframes(infile: Path, chunk_dir: Path, chunks: int, duration_s: float) -> list[Path]:
+    """Stream-copy the video track into ~equal pieces. The segment muxer only cuts on keyframes."""
+    cmd = [
+        "ffmpeg", "-y", "-i", str(infile),
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", f"{duration_s / chunks:.3f}",
+        "-reset_timestamps", "1",
+        str(chunk_dir / "src%03d.mkv"),
+    ]
+    await run(cmd)
+    return sorted(chunk_dir.glob("src*.mkv"))
+
+
+async def encode_chunk(
+    src: Path,
+    dst: Path,
+    codec: str,
+    preset: str,
+    video_kbps: int,
+    vf=None,
+    legacy_rate_control: bool = False,
+    threads: int = 4,
+    cancel: threading.Event | None = None,
+):
+    """2-pass, video-only encode of one chunk at the job's overall video bitrate."""
+    passlog = str(dst) + ".passlog"
+    null_sink = "NUL" if os.name == "nt" else "/dev/null"
+
+    cmd = ["ffmpeg", "-y", "-i", str(src)]
+    if vf:
+        cmd += ["-vf", vf]
+    cmd += [
+        "-c:v", codec,
+        "-preset", preset,
+        "-b:v", f"{video_kbps}k",
+        "-threads", str(threads),
+    ]
+    if legacy_rate_control:
+        cmd += ["-maxrate", f"{int(video_kbps * 1.2)}k", "-bufsize", f"{int(video_kbps * 2)}k"]
+
+    try:
+        await run_progress(cmd + ["-pass", "1", "-passlogfile", passlog, "-an", "-f", "matroska", null_sink], cancel=cancel)
+        await run_progress(cmd + ["-pass", "2", "-passlogfile", passlog, "-an", str(dst)], cancel=cancel)
+    finally:
+        cleanup_passlog_set(passlog)
+
+
+async def encode_chunked(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    codec: str,
+    preset: str,
+    audio_kbps: int,
+    fps=None,
+    scale_width=None,
+    legacy_rate_control: bool = False,
+    threads: int = 4,
+    chunks: int = 4,
+    cancel: threading.Event | None = None,
+    job: EncodeJob | None = None,
+):
+    """
+    Segment-parallel encode to target size.
+    Splits the source at keyframes into `chunks` pieces, encodes them concurrently
+    (each at the video kbps from compute_target_kbps, so per-chunk budgets sum to
+    the overall budget), then joins them with the concat demuxer and muxes in
+    audio encoded once from the full source (the job's shared track, if given).
+    """
+    job_audio = None
+    if job is not None:
+        job_audio = await job.audio_track(audio_kbps, cancel=cancel)
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps, job_audio.stat().st_size if job_audio else 0)
+    else:
+        v_k, a_k = compute_target_kbps(duration_s, audio_kbps)
+    vf = build_vf(scale_width=scale_width, fps=fps)
+
+    chunk_dir = outfile.with_name(outfile.stem + "__chunks")
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    chunk_dir.mkdir(parents=True)
+
+    try:
+        sources = await split_at_keyframes(infile, chunk_dir, chunks, duration_s)
+        encoded = [src.with_name("enc" + src.name[3:]) for src in sources]
+        if job is not None:
+            audio = job_audio
+        else:
+            audio = chunk_dir / "audio.m4a" if has_audio(await probe_media(infile)) else None
+
+        tasks = [
+            asyncio.ensure_future(encode_chunk(
+                src, dst, codec, preset, v_k,
+                vf=vf,
+                legacy_rate_control=legacy_rate_control,
+                threads=threads,
+                cancel=cancel,
+            ))
+            for src, dst in zip(sources, encoded)
+        ]
+        if audio and job is None:
+            tasks.append(asyncio.ensure_future(run_progress(
+                ["ffmpeg", "-y", "-i", str(infile), "-map", "0:a:0", "-c:a", "aac", "-b:a", f"{a_k}k", str(audio)],
+                cancel=cancel,
+            )))
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One chunk failed or the attempt was cancelled: stop the siblings too
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        # concat demuxer list; single quotes inside paths are escaped as '\''
+        listfile = chunk_dir / "concat.txt"
+        listfile.write_text("".join(
+            "file '" + p.as_posix().replace("'", "'\\''") + "'\n" for p in encoded
+        ))
+
+        cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(listfile)]
+        if audio:
+            cmd += ["-i", str(audio), "-map", "0:v:0", "-map", "1:a:0"]
+        cmd += ["-c", "copy", "-movflags", "+faststart"]
+        if codec == "libx265":
+            cmd += ["-tag:v", "hvc1"]
+        cmd += [str(outfile)]
+        await run_progress(cmd, cancel=cancel)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+async def sample_estimate(
+    infile: Path,
+    tmp_base: Path,
+    duration_s: float,
+    codec: str,
+    preset: str,
+    audio_kbps: int,
+    fps=None,
+    scale_width=None,
+    threads: int = 4,
+    cancel: threading.Event | None = None,
+    crf: int | None = None,
+) -> dict:
+    """
+    Encode SAMPLE_COUNT short segments with the rung's filters and extrapolate.
+    Samples are encoded at crf (default: the codec's quality floor, the top of
+    CRF_RANGE) with no bitrate cap, which measures how compressible the content
+    is at this rung: if even the floor projects over the target, a 2-pass encode
+    at the rung's bitrate can only fit by dropping below it.
+    Returns {"size": projected bytes}.
+    """
+    _, a_k = compute_target_kbps(duration_s, audio_kbps)
+    vf = build_vf(scale_width=scale_width, fps=fps)
+    if crf is None:
+        crf = CRF_RANGE.get(codec, CRF_RANGE["libx264"])[1]
+
+    total_bytes = 0
+    sampled_s = 0.0
+    for k in range(SAMPLE_COUNT):
+        if cancel is not None and cancel.is_set():
+            raise EncodeAborted("cancelled")
+        start = max(duration_s * (k + 0.5) / SAMPLE_COUNT - SAMPLE_SECONDS / 2, 0)
+        seg = tmp_base.with_name(tmp_base.stem + f"__sample{k}.mp4")
+
+        cmd = ["ffmpeg", "-y", "-ss", f"{start:.3f}", "-t", str(SAMPLE_SECONDS), "-i", str(infile)]
+        if vf:
+            cmd += ["-vf", vf]
+        cmd += ["-c:v", codec, "-preset", preset, "-crf", str(crf)]
+        cmd += ["-threads", str(threads)]
+        cmd += ["-c:a", "aac", "-b:a", f"{a_k}k", "-f", "mp4", str(seg)]
+
+        try:
+            await run(cmd)
+            total_bytes += seg.stat().st_size
+            # Segments overlap (and the last one is cut short) on clips shorter than the samples
+            sampled_s += min(SAMPLE_SECONDS, duration_s - start)
+        finally:
+            seg.unlink(missing_ok=True)
+
+    return {"size": int(total_bytes * duration_s / max(sampled_s, 0.1))}
+
+
+def attempt_path(outfile: Path, rung: tuple) -> Path:
+    """Temp output of one ladder rung, next to outfile."""
+    codec, preset, fps, audio_kbps, scale_width = rung
+    return outfile.with_name(
         outfile.stem
         + f"__{codec}_fps{fps or 'src'}_a{audio_kbps}"
         + (f"_w{scale_width}" if scale_width else "")
         + ".mp4"
     )
 
+
+async def attempt_encode(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    codec: str,
+    preset: str,
+    audio_kbps: int,
+    fps=None,
+    scale_width=None,
+    legacy_rate_control: bool = False,
+    threads: int = 4,
+    sample_probe: bool = False,
+    chunks: int = 1,
+    cancel: threading.Event | None = None,
+    job: EncodeJob | None = None,
+    rate_control: str = "2pass",
+) -> Path | None:
+    tmp_out = attempt_path(outfile, (codec, preset, fps, audio_kbps, scale_width))
+
+    # Only use the chunked engine when every chunk is long enough to be worth it
+    chunks = min(chunks, int(duration_s // CHUNK_MIN_SECONDS))
+
+    attempt = job.attempt_label(tmp_out) if job is not None else None
+    started = time.perf_counter()
+
+    def finish(status: str, **fields):
+        if job is not None:
+            elapsed = round(time.perf_counter() - started, 3)
+            job.emit("attempt_end", attempt=attempt, status=status, elapsed=elapsed, **fields)
+
+    if job is not None:
+        job.emit(
+            "attempt_start", attempt=attempt,
+            codec=codec, preset=preset, fps=fps, audio_kbps=audio_kbps, scale_width=scale_width,
+            engine="chunked" if chunks > 1 else rate_control,
+        )
+
+    if sample_probe and duration_s >= SAMPLE_MIN_DURATION:
+        try:
+            est = await sample_estimate(
+                infile, tmp_out, duration_s,
+                codec, preset, audio_kbps,
+                fps=fps, scale_width=scale_width,
+                threads=threads,
+                cancel=cancel,
+            )
+        except EncodeAborted as e:
+            finish("aborted", reason=str(e))
+            return None
+        except RuntimeError as e:
+            finish("error", error=str(e))
+            raise
+        print(f"Sample estimate {tmp_out.name} at the quality floor: {est['size'] / (1024 * 1024):.2f} MB")
+        if est["size"] > TARGET_BYTES * SAMPLE_REJECT_MARGIN:
+            finish("sample_rejected", projected_size=est["size"])
+            return None
+
     passlog = None
     try:
-        passlog = encode_2pass(
-            infile=infile,
-            outfile=tmp_out,
-            duration_s=duration_s,
-            codec=codec,
-            preset=preset,
-            audio_kbps=audio_kbps,
-            fps=fps,
-            scale_width=scale_width,
-            legacy_rate_control=legacy_rate_control,
-            threads=threads,
-        )
+        if chunks > 1:
+            await encode_chunked(
+                infile, tmp_out, duration_s,
+                codec, preset, audio_kbps,
+                fps=fps, scale_width=scale_width,
+                legacy_rate_control=legacy_rate_control,
+                threads=threads,
+                chunks=chunks,
+                cancel=cancel,
+                job=job,
+            )
+        else:
+            crf = None
+            # Short clips cost about as much to sample as to encode: 2-pass directly
+            if rate_control == "crf" and duration_s >= SAMPLE_MIN_DURATION:
+                known, crf = job.known_crf(codec) if job is not None else (False, None)
+                if known:
+                    print(f"CRF for {tmp_out.name} from an earlier rung: {crf if crf is not None else 'none, using 2-pass'}")
+                else:
+                    crf = await crf_search(
+                        infile, tmp_out, duration_s,
+                        codec, preset, audio_kbps,
+                        fps=fps, scale_width=scale_width,
+                        threads=threads,
+                        cancel=cancel,
+                    )
+                    if job is not None:
+                        job.settle_crf(codec, crf)
+                        job.emit("crf_search", attempt=attempt, crf=crf)
+                    if crf is None:
+                        print(f"No CRF predicted to fit for {tmp_out.name}; using 2-pass")
+
+            if crf is not None:
+                try:
+                    await encode_crf(
+                        infile, tmp_out, duration_s,
+                        codec, preset, audio_kbps, crf,
+                        fps=fps, scale_width=scale_width,
+                        threads=threads,
+                        cancel=cancel,
+                        job=job,
+                    )
+                    if tmp_out.stat().st_size > TARGET_BYTES:
+                        raise EncodeAborted(f"{tmp_out.stat().st_size / (1024 * 1024):.2f} MB exceeds target")
+                except EncodeAborted as e:
+                    if cancel is not None and cancel.is_set():
+                        raise
+                    print(f"CRF {crf} overshot for {tmp_out.name} ({e}); falling back to 2-pass")
+                    if job is not None:
+                        job.settle_crf(codec, None)
+                        job.emit("crf_fallback", attempt=attempt, crf=crf, reason=str(e))
+                    tmp_out.unlink(missing_ok=True)
+                    crf = None
+
+            if crf is None:
+                passlog = await encode_2pass(
+                    infile=infile,
+                    outfile=tmp_out,
+                    duration_s=duration_s,
+                    codec=codec,
+                    preset=preset,
+                    audio_kbps=audio_kbps,
+                    fps=fps,
+                    scale_width=scale_width,
+                    legacy_rate_control=legacy_rate_control,
+                    threads=threads,
+                    cancel=cancel,
+                    job=job,
+                )
+    except EncodeAborted as e:
+        print(f"Aborted {tmp_out.name}: {e}")
+        tmp_out.unlink(missing_ok=True)
+        finish("aborted", reason=str(e))
+        return None
+    except RuntimeError as e:
+        finish("error", error=str(e))
+        raise
     finally:
-        if passlog:
-            cleanup_passlog_set(passlog)
+        # Without a job, encode_2pass names its passlog after the output; clean it even
+        # if it raised. Job-cached passlogs are removed by EncodeJob.close().
+        if job is None:
+            cleanup_passlog_set(passlog or str(tmp_out) + ".passlog")
 
     if not tmp_out.exists():
+        finish("error", error="no output written")
         return None
 
-    if tmp_out.stat().st_size <= TARGET_BYTES:
+    size = tmp_out.stat().st_size
+    if size <= TARGET_BYTES:
+        finish("fit", size=size)
         return tmp_out
 
+    finish("too_big", size=size)
     return None
 
 
-def new_strategy(infile: Path, outfile: Path, duration_s: float, threads: int = 4) -> Path | None:
-    # Try HEVC + fps/audio tweaks without scaling first
-    for codec, preset, fps, audio_kbps in NEW_ATTEMPTS_PRE_SCALE:
-        try:
-            out = attempt_encode(
-                infile, outfile, duration_s,
-                codec, preset, audio_kbps,
-                fps=fps, scale_width=None,
-                legacy_rate_control=False,
-                threads=threads,
-            )
-            if out:
-                return out
-        except RuntimeError:
-            # If x265 fails on user's ffmpeg build, continue; legacy fallback likely succeeds with x264.
-            continue
-
+def new_ladder() -> list[tuple]:
+    """
+    Full ladder for the new strategy, best quality first.
+    Each rung is (codec, preset, fps, audio_kbps, scale_width).
+    """
+    ladder = [
+        (codec, preset, fps, audio_kbps, None)
+        for codec, preset, fps, audio_kbps in NEW_ATTEMPTS_PRE_SCALE
+    ]
     # Final fallback in "new strategy": scale, but keep the better efficiency settings
     codec, preset, fps, audio_kbps = ("libx265", "medium", 30, 64)
-    for w in DOWNSCALE_WIDTHS:
-        try:
-            out = attempt_encode(
-                infile, outfile, duration_s,
-                codec, preset, audio_kbps,
-                fps=fps, scale_width=w,
-                legacy_rate_control=False,
-                threads=threads,
-            )
-            if out:
-                return out
-        except RuntimeError:
+    ladder += [(codec, preset, fps, audio_kbps, w) for w in DOWNSCALE_WIDTHS]
+    return ladder
+
+
+def cache_settings(engine: str, chunks: int, rate_control: str, sample_probe: bool) -> dict:
+    """
+    Everything that decides which output a video job produces, for the result
+    cache key: changing the ladders, a tunable (SAFETY_FACTOR, the early-abort
+    and pass-1 reuse thresholds, ...) or an option invalidates earlier entries
+    instead of serving stale outputs.
+    """
+    settings = {
+        "kind": "video",
+        "target_bytes": TARGET_BYTES,
+        "safety_factor": SAFETY_FACTOR,
+        "min_video_kbps": MIN_VIDEO_KBPS,
+        "min_bits_per_pixel": MIN_BITS_PER_PIXEL,
+        "abort": [ABORT_MIN_PROGRESS, ABORT_OVERSHOOT],
+        "pass1_reuse_tolerance": PASS1_REUSE_TOLERANCE,
+        "ladders": [new_ladder(), legacy_ladder()],
+        "engine": engine,
+        "chunks": chunks,
+        "rate_control": rate_control,
+        "sample_probe": sample_probe,
+    }
+    if rate_control == "crf":
+        settings["crf"] = [CRF_RANGE, CRF_MAXRATE_FACTOR]
+    if sample_probe:
+        settings["sample"] = [SAMPLE_COUNT, SAMPLE_SECONDS, SAMPLE_REJECT_MARGIN]
+    return settings
+
+
+def describe_rung(rung: tuple) -> str:
+    codec, preset, fps, audio_kbps, scale_width = rung
+    return f"{codec}/{preset} fps={fps or 'src'} audio={audio_kbps}k width={scale_width or 'src'}"
+
+
+def predict_rung(ladder: list[tuple], meta: dict, duration_s: float) -> int:
+    """
+    Predict the first rung likely to fit TARGET_BYTES at acceptable quality.
+
+    A rung is a candidate when its video budget is not clamped to MIN_VIDEO_KBPS
+    (that would overshoot) and its bits-per-pixel is at least MIN_BITS_PER_PIXEL
+    for the codec. If the source bitrate is already within budget, the top rung wins.
+    """
+    width, height, src_fps = meta.get("width"), meta.get("height"), meta.get("fps")
+    if not (width and height and src_fps):
+        return 0
+
+    for i, (codec, preset, fps, audio_kbps, scale_width) in enumerate(ladder):
+        v_k, _ = compute_target_kbps(duration_s, audio_kbps)
+        if v_k <= MIN_VIDEO_KBPS:
             continue
 
-    return None
+        src_bps = meta.get("bit_rate")
+        if src_bps and src_bps <= (v_k + audio_kbps) * 1000:
+            return i
+
+        out_w, out_h = width, height
+        if scale_width is not None and scale_width < width:
+            out_w, out_h = scale_width, height * scale_width / width
+        out_fps = min(fps, src_fps) if fps else src_fps
+
+        bpp = v_k * 1000 / (out_w * out_h * out_fps)
+        if bpp >= MIN_BITS_PER_PIXEL.get(codec, 0.05):
+            return i
+
+    # Nothing looks comfortable; start at the cheapest rung.
+    return len(ladder) - 1
 
 
-def legacy_strategy(infile: Path, outfile: Path, duration_s: float, threads: int = 4) -> Path | None:
+def legacy_ladder() -> list[tuple]:
     # Old behavior: H.264 2-pass + scale steps; include maxrate/bufsize like the old script
     codec, preset, audio_kbps = ("libx264", "medium", 96)
+    return [(codec, preset, None, audio_kbps, w) for w in LEGACY_DOWNSCALE_STEPS]
+
+
+async def try_rung(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    rung: tuple,
+    threads: int = 4,
+    sample_probe: bool = False,
+    legacy_rate_control: bool = False,
+    chunks: int = 1,
+    cancel: threading.Event | None = None,
+    job: EncodeJob | None = None,
+    rate_control: str = "2pass",
+) -> Path | None:
+    codec, preset, fps, audio_kbps, scale_width = rung
+    try:
+        return await attempt_encode(
+            infile, outfile, duration_s,
+            codec, preset, audio_kbps,
+            fps=fps, scale_width=scale_width,
+            legacy_rate_control=legacy_rate_control,
+            threads=threads,
+            sample_probe=sample_probe,
+            chunks=chunks,
+            cancel=cancel,
+            job=job,
+            rate_control=rate_control,
+        )
+    except RuntimeError:
+        # If x265 fails on user's ffmpeg build, continue; legacy fallback likely succeeds with x264.
+        return None
+
+
+async def search_ladder(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    ladder: list[tuple],
+    start: int = 0,
+    threads: int = 4,
+    sample_probe: bool = False,
+    legacy_rate_control: bool = False,
+    parallel: int = 1,
+    chunks: int = 1,
+    job: EncodeJob | None = None,
+    cancel: threading.Event | None = None,
+    rate_control: str = "2pass",
+    multi: int = 1,
+) -> tuple[int, Path] | None:
+    """
+    Walk ladder[start:] and return (index, temp output) of the first rung that fits.
+
+    With parallel > 1, up to that many rungs encode concurrently in separate
+    ffmpeg processes. Preference order still wins: a rung that fits cancels
+    every rung below it, but rungs above it keep running and replace it if
+    they fit too. Cancelled rungs clean up their own temp files and passlogs.
+    If cancel is set, every running rung is stopped and EncodeAborted is raised.
+    With multi > 1, rungs are encoded in groups of that many from a single
+    decode (see search_ladder_multi).
+    """
+    if multi > 1:
+        return await search_ladder_multi(
+            infile, outfile, duration_s, ladder, start,
+            threads=threads, legacy_rate_control=legacy_rate_control, multi=multi, job=job, cancel=cancel,
+        )
+
+    indices = list(range(start, len(ladder)))
+    cancels = {i: threading.Event() for i in indices}
+    best = None
+    running = {}
+    pending = iter(indices)
+
+    def submit_next():
+        while len(running) < max(parallel, 1):
+            if cancel is not None and cancel.is_set():
+                return
+            i = next(pending, None)
+            if i is None or (best is not None and i > best[0]):
+                return
+            running[asyncio.ensure_future(try_rung(
+                infile, outfile, duration_s, ladder[i],
+                threads=threads,
+                sample_probe=sample_probe,
+                legacy_rate_control=legacy_rate_control,
+                chunks=chunks,
+                cancel=cancels[i],
+                job=job,
+                rate_control=rate_control,
+            ))] = i
 
-    for w in LEGACY_DOWNSCALE_STEPS:
+    try:
+        submit_next()
+        while running:
+            done, _ = await asyncio.wait(running, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+            if cancel is not None and cancel.is_set():
+                for ev in cancels.values():
+                    ev.set()
+            for task in done:
+                i = running.pop(task)
+                out = task.result()
+                if out is None:
+                    continue
+
+                if best is None or i < best[0]:
+                    if best is not None:
+                        best[1].unlink(missing_ok=True)
+                    best = (i, out)
+                    # Everything below the new winner is now pointless
+                    for j, ev in cancels.items():
+                        if j > i:
+                            ev.set()
+                else:
+                    # A lower rung finished before its cancel landed
+                    out.unlink(missing_ok=True)
+
+            submit_next()
+    except BaseException:
+        # A rung raised or this task was cancelled: stop the rest and wait for their cleanup
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+
+    if cancel is not None and cancel.is_set():
+        if best is not None:
+            best[1].unlink(missing_ok=True)
+        raise EncodeAborted("cancelled")
+    return best
+
+
+async def search_ladder_multi(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    ladder: list[tuple],
+    start: int = 0,
+    threads: int = 4,
+    legacy_rate_control: bool = False,
+    multi: int = 2,
+    job: EncodeJob | None = None,
+    cancel: threading.Event | None = None,
+) -> tuple[int, Path] | None:
+    """
+    search_ladder for multi-output encodes: ladder[start:] is taken `multi`
+    rungs at a time, each group encoded by one encode_multi call, and the
+    best-quality rung that fits wins. Later groups only run if none fit.
+    """
+    for first in range(start, len(ladder), multi):
+        if cancel is not None and cancel.is_set():
+            raise EncodeAborted("cancelled")
+
+        indices = list(range(first, min(first + multi, len(ladder))))
+        rungs = [ladder[i] for i in indices]
+        outs = [attempt_path(outfile, rung) for rung in rungs]
+        started = time.perf_counter()
+        if job is not None:
+            for out, (codec, preset, fps, audio_kbps, scale_width) in zip(outs, rungs):
+                job.emit(
+                    "attempt_start", attempt=job.attempt_label(out),
+                    codec=codec, preset=preset, fps=fps, audio_kbps=audio_kbps, scale_width=scale_width,
+                    engine="multi",
+                )
+
+        def finish(out: Path, status: str, **fields):
+            if job is not None:
+                elapsed = round(time.perf_counter() - started, 3)
+                job.emit("attempt_end", attempt=job.attempt_label(out), status=status, elapsed=elapsed, **fields)
+
+        print(f"Multi-output encode: {', '.join(describe_rung(r) for r in rungs)}")
         try:
-            out = attempt_encode(
-                infile, outfile, duration_s,
-                codec, preset, audio_kbps,
-                fps=None, scale_width=w,
-                legacy_rate_control=True,
+            await encode_multi(
+                infile, outs, duration_s, rungs,
+                legacy_rate_control=legacy_rate_control,
                 threads=threads,
+                cancel=cancel,
+                job=job,
             )
-            if out:
-                return out
-        except RuntimeError:
+        except EncodeAborted as e:
+            for out in outs:
+                finish(out, "aborted", reason=str(e))
+            raise
+        except RuntimeError as e:
+            # As in try_rung: an encoder this ffmpeg build lacks should not end the search
+            print(f"Multi-output encode failed: {e}")
+            for out in outs:
+                finish(out, "error", error=str(e))
             continue
 
+        best = None
+        for i, out in zip(indices, outs):
+            if not out.exists():
+                finish(out, "error", error="no output written")
+                continue
+            size = out.stat().st_size
+            if size > TARGET_BYTES:
+                finish(out, "too_big", size=size)
+                out.unlink(missing_ok=True)
+            elif best is None:
+                finish(out, "fit", size=size)
+                best = (i, out)
+            else:
+                # Fits, but a better rung in the same group already did
+                finish(out, "superseded", size=size)
+                out.unlink(missing_ok=True)
+        if best is not None:
+            return best
+
     return None
 
 
-def process_video(input_path: str, output_path: str = None, threads: int = 4) -> str:
+async def has_headroom(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    rung: tuple,
+    threads: int = 4,
+    cancel: threading.Event | None = None,
+) -> bool:
+    """True if rung's sample estimate at the quality floor fits TARGET_BYTES * SAFETY_FACTOR."""
+    codec, preset, fps, audio_kbps, scale_width = rung
+    try:
+        est = await sample_estimate(
+            infile, attempt_path(outfile, rung), duration_s,
+            codec, preset, audio_kbps,
+            fps=fps, scale_width=scale_width,
+            threads=threads,
+            cancel=cancel,
+        )
+    except RuntimeError:
+        return False
+    print(f"Step-up estimate {describe_rung(rung)} at the quality floor: {est['size'] / (1024 * 1024):.2f} MB")
+    return est["size"] <= TARGET_BYTES * SAFETY_FACTOR
+
+
+async def new_strategy(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    threads: int = 4,
+    meta: dict | None = None,
+    sample_probe: bool = False,
+    parallel: int = 1,
+    chunks: int = 1,
+    job: EncodeJob | None = None,
+    cancel: threading.Event | None = None,
+    rate_control: str = "2pass",
+    multi: int = 1,
+) -> tuple[tuple, Path] | None:
+    """Returns (winning rung, temp output) or None."""
+    ladder = new_ladder()
+    start = predict_rung(ladder, meta or {}, duration_s)
+    print(f"Predicted rung {start}: {describe_rung(ladder[start])}")
+
+    # Step down from the predicted rung until something fits
+    winner = await search_ladder(
+        infile, outfile, duration_s, ladder, start,
+        threads=threads, sample_probe=sample_probe, parallel=parallel, chunks=chunks, job=job, cancel=cancel,
+        rate_control=rate_control, multi=multi,
+    )
+
+    if winner is None:
+        print(f"Ladder rung: predicted {start}, actual none")
+        return None
+
+    # Prediction may have been conservative, but a 2-pass encode lands near the
+    # target whatever the rung, so the winner's size says nothing about headroom.
+    # With the sample probe on, a floor-quality estimate under target for the rung
+    # just above is that evidence: try that one rung. Anything above a stepped-down
+    # winner already missed.
+    i, out = winner
+    if i == start and i > 0 and sample_probe and await has_headroom(
+        infile, outfile, duration_s, ladder[i - 1], threads, cancel
+    ):
+        better = await try_rung(
+            infile, outfile, duration_s, ladder[i - 1],
+            threads=threads, chunks=chunks, job=job, cancel=cancel, rate_control=rate_control,
+        )
+        if better:
+            try:
+                out.unlink()
+            except Exception:
+                pass
+            winner = (i - 1, better)
+
+    print(f"Ladder rung: predicted {start}, actual {winner[0]} ({describe_rung(ladder[winner[0]])})")
+    return ladder[winner[0]], winner[1]
+
+
+async def legacy_strategy(
+    infile: Path,
+    outfile: Path,
+    duration_s: float,
+    threads: int = 4,
+    sample_probe: bool = False,
+    parallel: int = 1,
+    chunks: int = 1,
+    job: EncodeJob | None = None,
+    cancel: threading.Event | None = None,
+    rate_control: str = "2pass",
+    multi: int = 1,
+) -> tuple[tuple, Path] | None:
+    """Returns (winning rung, temp output) or None."""
+    ladder = legacy_ladder()
+    winner = await search_ladder(
+        infile, outfile, duration_s, ladder,
+        threads=threads,
+        sample_probe=sample_probe,
+        legacy_rate_control=True,
+        parallel=parallel,
+        chunks=chunks,
+        job=job,
+        cancel=cancel,
+        rate_control=rate_control,
+        multi=multi,
+    )
+    return (ladder[winner[0]], winner[1]) if winner else None
+
+
+def plan_fast_paths(infile: Path, info: dict) -> list[tuple]:
+    """
+    Decide from the probe which cheap outputs are worth trying before the ladder,
+    cheapest first. Each entry is ("copy",), ("remux",) or ("audio", audio_kbps).
+    An empty list means the full ladder is needed.
+    """
+    fmt = info.get("format") or {}
+    video = first_stream(info, "video")
+    audio = first_stream(info, "audio")
+    if video is None or video.get("codec_name") not in MP4_VIDEO_CODECS:
+        return []
+
+    try:
+        size = int(fmt["size"])
+    except (KeyError, TypeError, ValueError):
+        size = infile.stat().st_size
+    try:
+        duration_s = float(fmt["duration"])
+    except (KeyError, TypeError, ValueError):
+        return []
+
+    audio_copyable = audio is None or audio.get("codec_name") in MP4_AUDIO_CODECS
+    is_mp4 = "mp4" in fmt.get("format_name", "").split(",") and infile.suffix.lower() in (".mp4", ".m4v")
+
+    plans = []
+    if size <= TARGET_BYTES and is_mp4 and audio_copyable:
+        plans.append(("copy",))
+
+    # Remux keeps only the main video/audio; extra tracks, subtitles and metadata are dropped
+    v_bps, a_bps = stream_bit_rate(video), stream_bit_rate(audio)
+    if audio_copyable:
+        if v_bps is not None and (audio is None or a_bps is not None):
+            primary_bytes = (v_bps + (a_bps or 0)) * duration_s / 8
+            if primary_bytes <= TARGET_BYTES:
+                plans.append(("remux",))
+        elif size <= TARGET_BYTES:
+            plans.append(("remux",))
+
+    # Video already fits; only the audio needs shrinking
+    if audio is not None and v_bps is not None:
+        for audio_kbps in sorted({rung[3] for rung in new_ladder()}, reverse=True):
+            if (v_bps + audio_kbps * 1000) * duration_s / 8 <= TARGET_BYTES * SAFETY_FACTOR:
+                plans.append(("audio", audio_kbps))
+                break
+
+    return plans
+
+
+async def run_fast_path(infile: Path, outfile: Path, info: dict, plan: tuple) -> Path | None:
+    """Produce the fast-path output as a temp file next to outfile; None if it does not fit."""
+    kind = plan[0]
+    tmp_out = outfile.with_name(outfile.stem + f"__fast_{'_'.join(map(str, plan))}.mp4")
+
+    if kind == "copy":
+        await asyncio.to_thread(shutil.copy2, infile, tmp_out)
+    else:
+        cmd = ["ffmpeg", "-y", "-i", str(infile), "-map", "0:v:0"]
+        if has_audio(info):
+            cmd += ["-map", "0:a:0"]
+        cmd += ["-c:v", "copy"]
+        if kind == "audio":
+            cmd += ["-c:a", "aac", "-b:a", f"{plan[1]}k"]
+        else:
+            cmd += ["-c:a", "copy"]
+        cmd += ["-map_metadata", "-1", "-movflags", "+faststart"]
+        if first_stream(info, "video").get("codec_name") == "hevc":
+            cmd += ["-tag:v", "hvc1"]
+        cmd += [str(tmp_out)]
+        try:
+            await run(cmd)
+        except RuntimeError as e:
+            print(f"Fast path {kind} failed: {e}")
+            tmp_out.unlink(missing_ok=True)
+            return None
+
+    if tmp_out.stat().st_size <= TARGET_BYTES:
+        return tmp_out
+
+    tmp_out.unlink(missing_ok=True)
+    return None
+
+
+async def process_video_async(
+    input_path: str,
+    output_path: str = None,
+    threads: int = 4,
+    sample_probe: bool = False,
+    parallel: int = 1,
+    engine: str = "2pass",
+    chunks: int = 4,
+    cache: result_cache.ResultCache | None = None,
+    info: dict | None = None,
+    on_event=None,
+    metrics_path=None,
+    cancel: threading.Event | None = None,
+    rate_control: str = "2pass",
+    scratch_dir=None,
+    multi: int = 1,
+) -> str:
     """
     Main logic to process a single video file.
+    If sample_probe=True, each rung is first sampled at the codec's quality-floor
+    CRF, and rungs whose content would not fit even there are skipped.
+    parallel > 1 runs that many ladder rungs concurrently (each with `threads`).
+    engine="chunked" encodes each rung as `chunks` keyframe-aligned pieces in parallel.
+    rate_control="crf" encodes each rung once at a CRF found on sample encodes
+    (crf_search), falling back to 2-pass for rungs where that overshoots.
+    multi > 1 encodes that many ladder rungs per ffmpeg run from one decode of
+    the source (2-pass only; not combined with parallel, sample_probe, the
+    chunked engine or CRF).
+    Temp files go to a private per-job directory under scratch_dir (default:
+    $SHRINK_SCRATCH, else the output folder), e.g. /dev/shm to spare the disk.
+    cache defaults to ResultCache.from_env(); a hit returns the stored output
+    immediately, or jumps straight to the stored winning rung if only that is left.
+    If info is given, it is filled with {"strategy", "rung", "cached"} for the winner.
+    on_event(event) receives structured progress events (job_start, probe,
+    attempt_start, progress, attempt_end, job_end; see EventLog), which are also
+    appended to metrics_path as JSON lines if given.
+    If cancel is set, running ffmpeg processes are killed, temp outputs and
+    passlogs are removed, and EncodeAborted is raised. Cancelling the task does
+    the same cleanup and then raises CancelledError.
     Returns the path to the successful output file.
     Raises RuntimeError or FileNotFoundError on failure.
     """
+    if info is None:
+        info = {}
+    events = EventLog(Path(input_path).resolve(), on_event, metrics_path)
+    started = time.perf_counter()
+    events.emit(
+        "job_start", output=output_path, engine=engine, rate_control=rate_control, target_bytes=TARGET_BYTES,
+    )
+    try:
+        out = await _process_video(
+            input_path, output_path, threads,
+            sample_probe=sample_probe, parallel=parallel, engine=engine, chunks=chunks,
+            cache=cache, info=info, events=events, cancel=cancel, rate_control=rate_control,
+            scratch_dir=scratch_dir, multi=multi,
+        )
+        elapsed = round(time.perf_counter() - started, 3)
+        events.emit("job_end", status="done", output=out, size=Path(out).stat().st_size, elapsed=elapsed, **info)
+        return out
+    except BaseException as e:
+        cancelled = isinstance(e, asyncio.CancelledError) or (cancel is not None and cancel.is_set())
+        events.emit(
+            "job_end", status="cancelled" if cancelled else "failed",
+            error=str(e) or type(e).__name__, elapsed=round(time.perf_counter() - started, 3),
+        )
+        raise
+    finally:
+        events.close()
+
+
+def process_video(
+    input_path: str,
+    output_path: str = None,
+    threads: int = 4,
+    sample_probe: bool = False,
+    parallel: int = 1,
+    engine: str = "2pass",
+    chunks: int = 4,
+    cache: result_cache.ResultCache | None = None,
+    info: dict | None = None,
+    on_event=None,
+    metrics_path=None,
+    cancel: threading.Event | None = None,
+    rate_control: str = "2pass",
+    scratch_dir=None,
+    multi: int = 1,
+) -> str:
+    """
+    Blocking process_video_async: runs the job on a private event loop.
+    Call it from a thread or process without a running loop.
+    """
+    return asyncio.run(process_video_async(
+        input_path, output_path, threads,
+        sample_probe=sample_probe, parallel=parallel, engine=engine, chunks=chunks,
+        cache=cache, info=info, on_event=on_event, metrics_path=metrics_path, cancel=cancel,
+        rate_control=rate_control, scratch_dir=scratch_dir, multi=multi,
+    ))
+
+
+async def _process_video(
+    input_path: str,
+    output_path: str,
+    threads: int,
+    sample_probe: bool,
+    parallel: int,
+    engine: str,
+    chunks: int,
+    cache: result_cache.ResultCache | None,
+    info: dict,
+    events: EventLog,
+    cancel: threading.Event | None,
+    rate_control: str,
+    scratch_dir,
+    multi: int,
+) -> str:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    if rate_control not in RATE_CONTROLS:
+        raise ValueError(f"Unknown rate control {rate_control!r}; expected one of {', '.join(RATE_CONTROLS)}")
+    if rate_control == "crf" and engine == "chunked":
+        raise ValueError("CRF rate control is not supported by the chunked engine")
+    if multi > 1 and (engine == "chunked" or rate_control == "crf" or parallel > 1 or sample_probe):
+        raise ValueError("Multi-output encodes cannot be combined with chunked, CRF, parallel or sample probes")
+    if engine != "chunked":
+        chunks = 1
+
     infile = Path(input_path).resolve()
     if not infile.exists():
         raise FileNotFoundError(f"Input not found: {infile}")
@@ -298,41 +1868,116 @@ def process_video(input_path: str, output_path: str = None, threads: int = 4) ->
     # Ensure workdir exists (if output_path was provided in a non-existent dir)
     workdir.mkdir(parents=True, exist_ok=True)
 
-    duration_s = get_duration_seconds(infile)
-    print(f"Duration: {duration_s:.2f}s | Target: <= {TARGET_MB} MB")
-
-    # --- Try new strategy first ---
-    print("\n== Trying quality-preserving strategy (HEVC + FPS/audio before scaling) ==")
-    out = new_strategy(infile, outfile, duration_s, threads=threads)
+    if cache is None:
+        cache = result_cache.ResultCache.from_env()
 
-    # --- If new strategy fails, use legacy approach ---
-    if out is None:
-        print("\n== New strategy failed. Falling back to legacy strategy (H.264 + scaling) ==")
-        out = legacy_strategy(infile, outfile, duration_s, threads=threads)
-
-    # Cleanup temp mp4s except the winner
-    for f in workdir.glob(outfile.stem + "__*.mp4"):
-        if out is None or f != out:
+    # Every temp output, sample, chunk and passlog of this job lives in its own
+    # scratch directory; the pipeline names them after scratch_out.
+    scratch = make_scratch_dir(scratch_dir or os.environ.get(SCRATCH_ENV) or workdir, outfile.stem)
+    scratch_out = scratch / outfile.name
+    try:
+        cached = None
+        if cache is not None:
+            settings = cache_settings(engine, chunks, rate_control, sample_probe)
+            # Hashing and copying block on the disk: keep them off the event loop
+            cache_key = await asyncio.to_thread(result_cache.content_key, infile, settings)
+            hit = scratch_out.with_name(outfile.stem + "__cached.mp4")
+            cached = await asyncio.to_thread(cache.lookup, cache_key, hit)
+            if cached and "output" in cached:
+                await asyncio.to_thread(move_into_place, hit, outfile)
+                print(f"Cache hit: {outfile} ({outfile.stat().st_size / (1024 * 1024):.2f} MB)")
+                info.update(strategy=cached.get("strategy"), rung=cached.get("rung"), cached=True)
+                return str(outfile)
+
+        probe = await probe_media(infile)
+        duration_s = media_duration(probe)
+        meta = video_meta(probe)
+        print(f"Duration: {duration_s:.2f}s | Target: <= {TARGET_MB} MB")
+        events.emit("probe", duration_s=duration_s, **meta)
+
+        out = None
+        winner = None  # (strategy, params) for the cache
+
+        # --- Cheap outputs first: copy, stream-copy remux, audio-only re-encode ---
+        for plan in plan_fast_paths(infile, probe):
+            if cancel is not None and cancel.is_set():
+                raise EncodeAborted("cancelled")
+            print(f"Trying fast path: {plan[0]}")
+            attempt = "fast_" + "_".join(map(str, plan))
+            events.emit("attempt_start", attempt=attempt, engine="fast")
+            t0 = time.perf_counter()
+            out = await run_fast_path(infile, scratch_out, probe, plan)
+            elapsed = round(time.perf_counter() - t0, 3)
+            if out:
+                events.emit("attempt_end", attempt=attempt, status="fit", elapsed=elapsed, size=out.stat().st_size)
+                winner = ("fast", list(plan))
+                break
+            events.emit("attempt_end", attempt=attempt, status="too_big", elapsed=elapsed)
+
+        if out is None:
+            # Pass-1 stats and audio side files live for the whole job so rungs can share them
+            job = EncodeJob(infile, scratch, outfile.stem, audio=has_audio(probe), events=events)
             try:
-                f.unlink()
-            except Exception:
-                pass
-
-    # Nuke pass logs everywhere (covers any weird naming)
-    cleanup_pass_files_everywhere(workdir)
+                # --- Known-good rung from an earlier run of the same content ---
+                if cached and cached.get("strategy") in ("new", "legacy"):
+                    rung = tuple(cached["rung"])
+                    print(f"Cache: trying known-good rung {describe_rung(rung)}")
+                    out = await try_rung(
+                        infile, scratch_out, duration_s, rung,
+                        threads=threads,
+                        legacy_rate_control=cached["strategy"] == "legacy",
+                        chunks=chunks,
+                        cancel=cancel,
+                        job=job,
+                        rate_control=rate_control,
+                    )
+                    if out:
+                        winner = (cached["strategy"], list(rung))
+
+                # --- Try new strategy first ---
+                if out is None:
+                    print("\n== Trying quality-preserving strategy (HEVC + FPS/audio before scaling) ==")
+                    result = await new_strategy(
+                        infile, scratch_out, duration_s,
+                        threads=threads, meta=meta, sample_probe=sample_probe, parallel=parallel, chunks=chunks,
+                        job=job, cancel=cancel, rate_control=rate_control, multi=multi,
+                    )
+                    if result:
+                        winner = ("new", list(result[0]))
+                        out = result[1]
+
+                # --- If new strategy fails, use legacy approach ---
+                if out is None:
+                    print("\n== New strategy failed. Falling back to legacy strategy (H.264 + scaling) ==")
+                    result = await legacy_strategy(
+                        infile, scratch_out, duration_s,
+                        threads=threads, sample_probe=sample_probe, parallel=parallel, chunks=chunks,
+                        job=job, cancel=cancel, rate_control=rate_control, multi=multi,
+                    )
+                    if result:
+                        winner = ("legacy", list(result[0]))
+                        out = result[1]
+            finally:
+                job.close()
+
+        if cancel is not None and cancel.is_set():
+            raise EncodeAborted("cancelled")
+        if out is None:
+            raise RuntimeError("Could not compress under 9.5MB. Try trimming the clip shorter.")
+
+        # Readers of outfile only ever see the old file or the complete winner
+        await asyncio.to_thread(move_into_place, out, outfile)
+    finally:
+        # Only this job's scratch: other jobs writing to the same folder are untouched
+        shutil.rmtree(scratch, ignore_errors=True)
 
-    if out is None:
-        raise RuntimeError("Could not compress under 9.5MB. Try trimming the clip shorter.")
+    print(f"\nSuccess: {outfile} ({outfile.stat().st_size / (1024 * 1024):.2f} MB)")
 
-    # Move winning temp output into final outfile name
-    try:
-        if outfile.exists():
-            outfile.unlink()
-    except Exception:
-        pass
+    strategy, params = winner
+    info.update(strategy=strategy, rung=params, cached=False)
+    if cache is not None:
+        await asyncio.to_thread(cache.store, cache_key, {"strategy": strategy, "rung": params}, output=outfile)
 
-    out.replace(outfile)
-    print(f"\nSuccess: {outfile} ({outfile.stat().st_size / (1024 * 1024):.2f} MB)")
     return str(outfile)
 
 
@@ -343,10 +1988,53 @@ def main():
     ap.add_argument("input", help="Input video path")
     ap.add_argument("-o", "--output", help="Output path (default: <input>_shrunk.mp4)")
     ap.add_argument("--threads", type=int, default=4, help="FFmpeg threads per encode job (default: 4)")
+    ap.add_argument(
+        "--sample-probe", action="store_true",
+        help="Estimate each rung from short sample encodes before running full encodes",
+    )
+    ap.add_argument(
+        "--parallel", type=int, default=1,
+        help="Max ladder rungs to encode concurrently, highest quality wins (default: 1)",
+    )
+    ap.add_argument(
+        "--engine", choices=ENGINES, default="2pass",
+        help="Encode engine per rung: whole-file 2-pass, or keyframe chunks in parallel (default: 2pass)",
+    )
+    ap.add_argument("--chunks", type=int, default=4, help="Chunks per encode for --engine chunked (default: 4)")
+    ap.add_argument(
+        "--multi", type=int, default=1,
+        help="Encode up to N ladder rungs per ffmpeg run from a single decode of the source (default: 1)",
+    )
+    ap.add_argument(
+        "--rate-control", choices=RATE_CONTROLS, default="2pass",
+        help="Per-rung rate control: 2-pass, or one CRF encode sized on samples with 2-pass fallback (default: 2pass)",
+    )
+    ap.add_argument(
+        "--cache-dir",
+        help="Result cache directory; repeated inputs return instantly (default: $SHRINK_CACHE_DIR, off if unset)",
+    )
+    ap.add_argument(
+        "--cache-max-mb", type=float, default=result_cache.DEFAULT_MAX_MB,
+        help=f"Result cache size limit in MB (default: {result_cache.DEFAULT_MAX_MB})",
+    )
+    ap.add_argument("--metrics", help="Append structured progress events to this JSONL file")
+    ap.add_argument(
+        "--scratch-dir",
+        help=f"Where per-job temp files go, e.g. /dev/shm (default: ${SCRATCH_ENV}, else the output folder)",
+    )
     args = ap.parse_args()
 
+    cache = None
+    if args.cache_dir:
+        cache = result_cache.ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+
     try:
-        process_video(args.input, args.output, args.threads)
+        process_video(
+            args.input, args.output, args.threads,
+            sample_probe=args.sample_probe, parallel=args.parallel,
+            engine=args.engine, chunks=args.chunks, cache=cache, metrics_path=args.metrics,
+            rate_control=args.rate_control, scratch_dir=args.scratch_dir, multi=args.multi,
+        )
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1 if "ffmpeg" in str(e) else 2)
@@ -0,0 +1,37 @@
+"""
+asyncio API for the video pipeline.
+
+  out = await shrink_async.process_video_async("clip.mp4", on_event=print)
+
+  python shrink_async.py VIDEO [VIDEO ...]   # all jobs concurrently on one loop
+
+The probe, ladder search and encodes are coroutines running on the caller's
+event loop, with every ffmpeg/ffprobe process created by
+asyncio.create_subprocess_exec. A job holds no thread of its own: N concurrent
+jobs are N tasks plus their ffmpeg processes. on_event(event) is called on the
+loop, so it may touch loop-bound state such as an asyncio.Queue. Cancelling
+the awaiting task terminates the job's ffmpeg processes and removes its temp
+outputs and passlogs before CancelledError propagates.
+
+shrink.process_video() is the same pipeline behind asyncio.run().
+"""
+import asyncio
+import sys
+
+from shrink import process_video_async
+
+__all__ = ["process_video_async"]
+
+
+async def _main(paths, **kwargs):
+    results = await asyncio.gather(
+        *(process_video_async(p, **kwargs) for p in paths), return_exceptions=True
+    )
+    for path, result in zip(paths, results):
+        print(f"{path}: {'FAILED: ' + str(result) if isinstance(result, BaseException) else result}")
+    return results
+
+
+if __name__ == "__main__":
+    results = asyncio.run(_main(sys.argv[1:]))
+    sys.exit(1 if any(isinstance(r, BaseException) for r in results) else 0)
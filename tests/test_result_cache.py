@@ -0,0 +1,124 @@
+"""
+result_cache.py: content keys, store/lookup round trips and LRU eviction.
+
+  python -m pytest tests/test_result_cache.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import result_cache  # noqa: E402
+
+SETTINGS = {"kind": "image", "target_bytes": 1000}
+
+
+class ContentKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def write(self, name, data):
+        path = self.tmp / name
+        path.write_bytes(data)
+        return path
+
+    def test_same_content_same_key_regardless_of_path(self):
+        a = self.write("a.jpg", b"x" * 5000)
+        b = self.write("copy of a.jpg", b"x" * 5000)
+        self.assertEqual(result_cache.content_key(a, SETTINGS), result_cache.content_key(b, SETTINGS))
+
+    def test_content_and_settings_change_key(self):
+        a = self.write("a.jpg", b"x" * 5000)
+        b = self.write("b.jpg", b"x" * 4999 + b"y")
+        key = result_cache.content_key(a, SETTINGS)
+        self.assertNotEqual(key, result_cache.content_key(b, SETTINGS))
+        self.assertNotEqual(key, result_cache.content_key(a, {**SETTINGS, "target_bytes": 999}))
+
+    def test_sampled_hash_of_large_file(self):
+        size = result_cache.HASH_CHUNK * (result_cache.HASH_SAMPLES + 2)
+        a = self.write("big.mp4", bytes(size))
+        data = bytearray(size)
+        data[0] = 1  # inside the first sampled chunk
+        b = self.write("big2.mp4", bytes(data))
+        self.assertNotEqual(result_cache.content_key(a, SETTINGS), result_cache.content_key(b, SETTINGS))
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.cache = result_cache.ResultCache(self.tmp / "cache", max_bytes=10_000)
+
+    def output(self, name, size):
+        path = self.tmp / name
+        path.write_bytes(b"o" * size)
+        return path
+
+    def age(self, key, seconds):
+        for path in self.cache._paths(key):
+            if path.exists():
+                st = path.stat()
+                os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.lookup("ab" * 20))
+        self.assertIsNone(self.cache.lookup("ab" * 20, self.tmp / "dest"))
+
+    def test_round_trip_copies_output(self):
+        self.cache.store("aa" * 20, {"suffix": ".jpg"}, output=self.output("out.jpg", 100))
+        dest = self.tmp / "restored.jpg"
+        meta = self.cache.lookup("aa" * 20, dest)
+        self.assertEqual(meta, {"suffix": ".jpg", "output": str(dest)})
+        self.assertEqual(dest.read_bytes(), b"o" * 100)
+
+    def test_dest_from_parameters(self):
+        self.cache.store("aa" * 20, {"suffix": ".jpg"}, output=self.output("out.jpg", 100))
+        meta = self.cache.lookup("aa" * 20, lambda meta: self.tmp / ("restored" + meta["suffix"]))
+        self.assertEqual(meta["output"], str(self.tmp / "restored.jpg"))
+        self.assertTrue((self.tmp / "restored.jpg").exists())
+
+    def test_parameters_without_output(self):
+        self.cache.store("aa" * 20, {"rung": 3})
+        meta = self.cache.lookup("aa" * 20, self.tmp / "dest")
+        self.assertEqual(meta, {"rung": 3})
+        self.assertFalse((self.tmp / "dest").exists())
+
+    def test_eviction_drops_least_recently_used_outputs_first(self):
+        old, new = "aa" * 20, "bb" * 20
+        self.cache.store(old, {"n": 1}, output=self.output("old", 4000))
+        self.age(old, 100)
+        self.cache.store(new, {"n": 2}, output=self.output("new", 4000))
+        self.age(new, 50)
+        self.cache.lookup(old, self.tmp / "hit")  # old is now the most recently used
+
+        self.cache.store("cc" * 20, {"n": 3}, output=self.output("third", 4000))
+
+        self.assertIn("output", self.cache.lookup(old, self.tmp / "d1"))
+        self.assertNotIn("output", self.cache.lookup(new, self.tmp / "d2"))
+        # Parameters outlive their outputs
+        self.assertEqual(self.cache.lookup(new)["n"], 2)
+
+    def test_eviction_skips_files_being_written(self):
+        self.cache.store("aa" * 20, {"n": 1}, output=self.output("a", 4000))
+        partial = self.cache._paths("aa" * 20)[1].with_name("partial.tmp")
+        partial.write_bytes(b"p" * 20_000)  # over the limit on its own
+        self.cache.evict()
+        self.assertTrue(partial.exists())
+
+    def test_store_rescans_periodically(self):
+        self.cache.store("aa" * 20, {"n": 1})
+        scans = []
+        real_scan = self.cache._scan
+        self.cache._scan = lambda: scans.append(1) or real_scan()
+        for k in range(result_cache.SCAN_EVERY):
+            self.cache.store(f"{k:040x}", {"n": k})
+        self.assertEqual(len(scans), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+"""
+server.py end to end on localhost, with process_video and shrink_image stubbed
+so no ffmpeg or real encoding is needed.
+
+  python -m pytest tests/test_server.py
+"""
+import json
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import image_shrinker  # noqa: E402
+import server  # noqa: E402
+import shrink  # noqa: E402
+
+TIMEOUT_S = 10
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.release = threading.Event()  # running videos block until this is set
+
+        patches = [
+            mock.patch.object(shrink, "process_video", self.fake_process_video),
+            mock.patch.object(image_shrinker, "shrink_image", self.fake_shrink_image),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+        # One core and one thread per video: one video runs, the rest wait
+        self.service = server.JobService(
+            cores=1, threads=1, max_queue=2, work_dir=self.tmp / "work", image_executor_cls=ThreadPoolExecutor,
+        )
+        self.httpd = server.make_server(self.service, port=0)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.addCleanup(self.shutdown)
+
+    def shutdown(self):
+        self.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.service.close()
+
+    def fake_process_video(self, input_path, output_path, threads=4, on_event=None, cancel=None, **kwargs):
+        emit = on_event or (lambda event: None)
+        emit({"event": "job_start", "time": time.time(), "input": input_path})
+        while not self.release.wait(0.01):
+            if cancel is not None and cancel.is_set():
+                raise shrink.EncodeAborted("cancelled")
+        emit({"event": "progress", "time": time.time(), "input": input_path, "percent": 100.0})
+        Path(output_path).write_bytes(b"shrunk:" + Path(input_path).read_bytes())
+        emit({"event": "job_end", "time": time.time(), "input": input_path, "status": "done", "output": output_path})
+        return output_path
+
+    @staticmethod
+    def fake_shrink_image(file_path, output_dir, cache=None):
+        out = Path(output_dir) / Path(file_path).name
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_bytes(b"shrunk:" + Path(file_path).read_bytes())
+        return str(out)
+
+    def request(self, method, path, data=None, content_type="application/json"):
+        """(status, headers, body bytes); HTTP errors are returned, not raised."""
+        req = urllib.request.Request(self.base + path, data=data, method=method, headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(req, timeout=TIMEOUT_S) as resp:
+                return resp.status, resp.headers, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def submit_path(self, name, content=b"video"):
+        path = self.tmp / name
+        path.write_bytes(content)
+        return self.request("POST", "/jobs", json.dumps({"path": str(path)}).encode())
+
+    def wait_for(self, job_id, *statuses):
+        deadline = time.monotonic() + TIMEOUT_S
+        while time.monotonic() < deadline:
+            job = json.loads(self.request("GET", f"/jobs/{job_id}")[2])
+            if job["status"] in statuses:
+                return job
+            time.sleep(0.02)
+        self.fail(f"job {job_id} never reached {statuses}")
+
+    def metrics(self):
+        return json.loads(self.request("GET", "/metrics")[2])
+
+    def test_submit_path_and_fetch_result(self):
+        self.release.set()
+        status, headers, body = self.submit_path("clip.mp4")
+        self.assertEqual(status, 202)
+        job = json.loads(body)
+        self.assertEqual(headers["Location"], f"/jobs/{job['id']}")
+
+        job = self.wait_for(job["id"], "done")
+        self.assertEqual(Path(job["output"]), self.tmp / "clip_shrunk.mp4")
+        status, _, body = self.request("GET", f"/jobs/{job['id']}/result")
+        self.assertEqual((status, body), (200, b"shrunk:video"))
+
+    def test_upload_image(self):
+        status, _, body = self.request("POST", "/jobs?name=photo.png", b"pixels", "application/octet-stream")
+        self.assertEqual(status, 202)
+        job = self.wait_for(json.loads(body)["id"], "done")
+        self.assertEqual(job["kind"], "image")
+        self.assertTrue(Path(job["input"]).is_relative_to(self.tmp / "work"))
+        status, _, body = self.request("GET", f"/jobs/{job['id']}/result")
+        self.assertEqual((status, body), (200, b"shrunk:pixels"))
+
+    def test_rejects_unsupported_and_missing_inputs(self):
+        self.assertEqual(self.request("POST", "/jobs?name=notes.txt", b"x", "application/octet-stream")[0], 400)
+        self.assertEqual(self.request("POST", "/jobs", json.dumps({"path": str(self.tmp / "nope.mp4")}).encode())[0], 404)
+
+    def test_overload_returns_503_and_metrics_show_queue(self):
+        running = json.loads(self.submit_path("a.mp4")[2])
+        self.wait_for(running["id"], "running")
+        self.assertEqual(self.submit_path("b.mp4")[0], 202)
+        self.assertEqual(self.submit_path("c.mp4")[0], 202)
+
+        status, headers, _ = self.submit_path("d.mp4")
+        self.assertEqual(status, 503)
+        self.assertEqual(headers["Retry-After"], str(server.RETRY_AFTER_S))
+
+        metrics = self.metrics()
+        self.assertEqual(metrics["queue_depth"], 2)
+        self.assertEqual(metrics["running"], 1)
+        self.assertEqual(metrics["cores_in_use"], 1)
+        self.assertEqual(metrics["counts"]["rejected"], 1)
+
+        self.release.set()
+        for job in metrics["jobs"]:
+            self.wait_for(job["id"], "done")
+        metrics = self.metrics()
+        self.assertEqual((metrics["queue_depth"], metrics["cores_in_use"]), (0, 0))
+        self.assertEqual(metrics["counts"]["done"], 3)
+        self.assertIsNotNone(metrics["mean_run_s"])
+
+    def test_delete_queued_job(self):
+        running = json.loads(self.submit_path("a.mp4")[2])
+        queued = json.loads(self.submit_path("b.mp4")[2])
+        self.wait_for(running["id"], "running")
+
+        status, _, body = self.request("DELETE", f"/jobs/{queued['id']}")
+        self.assertEqual(status, 202)
+        self.assertEqual(json.loads(body)["status"], "cancelled")
+        self.assertEqual(self.metrics()["queue_depth"], 0)
+        self.assertEqual(self.request("GET", f"/jobs/{queued['id']}/result")[0], 409)
+        self.assertEqual(self.request("DELETE", f"/jobs/{queued['id']}")[0], 409)
+
+        # A running video is stopped through its cancel event
+        self.assertEqual(self.request("DELETE", f"/jobs/{running['id']}")[0], 202)
+        self.assertEqual(self.wait_for(running["id"], "cancelled", "failed")["status"], "cancelled")
+
+    def test_events_stream_until_job_ends(self):
+        job = json.loads(self.submit_path("clip.mp4")[2])
+        threading.Timer(0.2, self.release.set).start()
+
+        status, headers, body = self.request("GET", f"/jobs/{job['id']}/events")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "application/x-ndjson")
+        events = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([e["event"] for e in events], ["queued", "job_start", "progress", "job_end"])
+        self.assertEqual(events[-1]["status"], "done")
+
+    def test_pool_cancelled_future_returns_budget(self):
+        # What ImageEngine.close() or shutdown(cancel_futures=True) leaves behind
+        job = server.Job("image", self.tmp / "photo.png")
+        self.service.jobs[job.id] = job
+        self.service.budget -= 1
+        future = Future()
+        future.cancel()
+        self.service._finished(job, 1, future)
+        self.assertEqual(job.status, "cancelled")
+        self.assertEqual(self.service.budget, self.service.cores)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+shrink.py's subprocess layer on asyncio: progress parsing, failures, and
+stopping ffmpeg on cancel. A small Python script stands in for ffmpeg.
+
+  python -m pytest tests/test_shrink_async.py
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import shrink  # noqa: E402
+
+TIMEOUT_S = 10
+
+# Prints a progress block every 50 ms until it has printed BLOCKS of them,
+# after writing its pid to PIDFILE. IGNORE_TERM=1 makes it ignore SIGTERM.
+FAKE_FFMPEG = """\
+import os, signal, sys, time
+if os.environ.get("IGNORE_TERM"):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+with open(os.environ["PIDFILE"], "w") as fh:
+    fh.write(str(os.getpid()))
+for n in range(int(os.environ.get("BLOCKS", "1000"))):
+    print(f"out_time_us={n * 1000}\\nprogress=continue", flush=True)
+    time.sleep(0.05)
+sys.stderr.write("fake ffmpeg failed\\n")
+sys.exit(int(os.environ.get("EXIT", "0")))
+"""
+
+
+class RunProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        # Executable, so run_progress can slip its ffmpeg flags in after cmd[0]
+        script = self.tmp / "ffmpeg"
+        script.write_text(f"#!{sys.executable}\n" + FAKE_FFMPEG)
+        script.chmod(0o755)
+        self.cmd = [str(script)]
+        self.pidfile = self.tmp / "pid"
+        self.env = {"PIDFILE": str(self.pidfile)}
+
+    def run_with_env(self, coro_fn, **env):
+        with mock.patch.dict(os.environ, {**self.env, **env}):
+            return asyncio.run(coro_fn())
+
+    def assert_exited(self):
+        pid = int(self.pidfile.read_text())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_progress_blocks_and_success(self):
+        blocks = []
+        result = self.run_with_env(
+            lambda: shrink.run_progress(self.cmd, on_progress=lambda s: blocks.append(dict(s))), BLOCKS="3",
+        )
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual([b["out_time_us"] for b in blocks], ["0", "1000", "2000"])
+
+    def test_failure_raises_with_stderr(self):
+        with self.assertRaisesRegex(RuntimeError, "fake ffmpeg failed"):
+            self.run_with_env(lambda: shrink.run_progress(self.cmd), BLOCKS="1", EXIT="1")
+
+    def test_cancel_event_aborts(self):
+        cancel = threading.Event()
+
+        def on_progress(stats):
+            if stats["out_time_us"] == "2000":
+                cancel.set()
+
+        with self.assertRaises(shrink.EncodeAborted):
+            self.run_with_env(lambda: shrink.run_progress(self.cmd, on_progress, cancel=cancel))
+        self.assert_exited()
+
+    async def cancel_after_start(self):
+        task = asyncio.ensure_future(shrink.run_progress(self.cmd))
+        for _ in range(TIMEOUT_S * 100):
+            if self.pidfile.exists() or task.done():
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    def test_cancelling_task_stops_process(self):
+        self.run_with_env(self.cancel_after_start)
+        self.assert_exited()
+
+    def test_process_ignoring_sigterm_is_killed(self):
+        with mock.patch.object(shrink, "STOP_GRACE_S", 0.2):
+            self.run_with_env(self.cancel_after_start, IGNORE_TERM="1")
+        self.assert_exited()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,375 @@
+"""
+Watch-folder daemon: keep shrinking whatever lands in one or more directories.
+
+  python watch.py DIR [DIR ...] [--threads 4] [--jobs N] [--settle 5] [--max-queue N]
+
+On Linux new files are noticed through inotify; elsewhere (or if inotify is
+unavailable) the folders are re-scanned every --poll seconds. A file is queued
+only once it has not been modified for --settle seconds, so half-copied
+uploads are never picked up. Jobs run on batch.JobPool's warm worker
+processes, share the same CPU/memory budget, logs and manifest as batch.py,
+and files already in the manifest are skipped exactly as batch.py would.
+
+Ctrl-C or SIGTERM stops watching and waits for running encodes to finish;
+a second signal aborts them (they are redone on the next start).
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import multiprocessing
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from pathlib import Path
+
+import batch
+from manifest import Manifest
+
+SETTLE_S = 5.0
+POLL_S = 2.0
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def walk(root: Path):
+    """Yield (folder, files) under root one folder at a time, skipping our own folders."""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        files = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not batch.skip_dir(entry.name):
+                    stack.append(Path(entry.path))
+            elif entry.is_file():
+                files.append(Path(entry.path))
+        yield folder, files
+
+
+class PollWatcher:
+    """Portable watcher: re-scans the roots and reports files whose size or mtime changed."""
+
+    def __init__(self, roots, interval: float = POLL_S):
+        self.roots = roots
+        self.interval = interval
+        self._next = 0.0
+        self._seen = self._snapshot()
+
+    def _snapshot(self) -> dict:
+        seen = {}
+        for root in self.roots:
+            for _, files in walk(root):
+                for path in files:
+                    if batch.file_kind(path) is None:
+                        continue
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    seen[path] = (st.st_size, st.st_mtime_ns)
+        return seen
+
+    def poll(self, timeout: float) -> list[Path]:
+        delay = self._next - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        self._next = time.monotonic() + self.interval
+        seen = self._snapshot()
+        changed = [path for path, stamp in seen.items() if self._seen.get(path) != stamp]
+        self._seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Linux watcher on inotify through libc, one watch per folder. New folders
+    are watched as they appear; if the kernel queue overflows, every root is
+    re-scanned so nothing is lost.
+    """
+
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.roots = roots
+        self._dirs = {}
+        try:
+            for root in roots:
+                self._watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, folder: Path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOENT:
+                return  # gone before we got to it
+            # ENOSPC: out of fs.inotify.max_user_watches
+            raise OSError(e, f"inotify_add_watch {folder}: {os.strerror(e)}")
+        self._dirs[wd] = folder
+
+    def _watch_tree(self, root: Path) -> list[Path]:
+        """Watch root and every folder below it; return the files already there."""
+        found = []
+        for folder, files in walk(root):
+            self._watch(folder)
+            found.extend(files)
+        return found
+
+    def poll(self, timeout: float) -> list[Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                print("inotify queue overflowed; re-scanning")
+                for root in self.roots:
+                    changed.extend(self._watch_tree(root))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            folder = self._dirs.get(wd)
+            if folder is None or not name:
+                continue
+            path = folder / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not batch.skip_dir(name):
+                    # Files may land in a new folder before its watch exists
+                    changed.extend(self._watch_tree(path))
+                continue
+            changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(roots, poll_interval: float = POLL_S):
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable ({e}); polling every {poll_interval:g}s")
+        return PollWatcher(roots, poll_interval)
+
+
+class Settler:
+    """
+    Holds changed files until they have not been modified for `settle` seconds.
+    A file is stat()ed only when it could first have settled, not on every tick.
+    """
+
+    def __init__(self, settle: float = SETTLE_S):
+        self.settle = settle
+        self._due = []  # heap of (check_at, path)
+        self._pending = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path: Path):
+        if path not in self._pending:
+            self._pending.add(path)
+            heapq.heappush(self._due, (time.time(), path))
+
+    def pop_ready(self, limit: int) -> list[tuple[Path, os.stat_result]]:
+        """Up to `limit` settled files as (path, stat); unsettled ones are re-scheduled."""
+        ready = []
+        now = time.time()
+        while self._due and self._due[0][0] <= now and len(ready) < limit:
+            _, path = heapq.heappop(self._due)
+            try:
+                st = path.stat()
+            except OSError:
+                self._pending.discard(path)  # deleted or renamed away
+                continue
+            settled_at = st.st_mtime + self.settle
+            if settled_at > now:
+                heapq.heappush(self._due, (settled_at, path))
+                continue
+            self._pending.discard(path)
+            ready.append((path, st))
+        return ready
+
+
+def _worker_init():
+    # Terminal Ctrl-C goes to the whole process group; keep workers and their
+    # ffmpeg children out of it so the daemon decides when encodes stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    # Unwind on SIGTERM so the job's scratch folder is still removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def kill_workers():
+    """Abort running jobs: SIGTERM each worker's process group (worker plus its ffmpeg)."""
+    for child in multiprocessing.active_children():
+        try:
+            os.killpg(child.pid, signal.SIGTERM)
+        except (AttributeError, OSError):
+            child.terminate()
+
+
+def watch(
+    roots,
+    threads: int = 4,
+    cores: int | None = None,
+    settle: float = SETTLE_S,
+    poll_interval: float = POLL_S,
+    max_queue: int | None = None,
+    manifest: Manifest | None = None,
+    retry_failed: bool = False,
+    on_result=None,
+    stop=None,
+) -> list[dict]:
+    """
+    Shrink existing and newly arriving files under roots until stop() returns
+    True, then let running jobs finish and return every result. At most
+    max_queue (default: 2 x cores) jobs wait for a worker; settled files
+    beyond that stay with the watcher until the queue drains.
+    """
+    roots = [Path(r).resolve() for r in roots]
+    jobs = batch.JobPool(threads, cores, manifest=manifest, initializer=_worker_init)
+    max_queue = max_queue or 2 * jobs.cores
+    settler = Settler(settle)
+    watcher = make_watcher(roots, poll_interval)
+    stop = stop or (lambda: False)
+    results = []
+    active = set()  # queued or running, so repeated events do not queue a file twice
+
+    known = manifest.load() if manifest is not None else None
+    for _, path, _, _ in batch.scan(roots, known, retry_failed):
+        settler.touch(path)
+    print(f"Watching {', '.join(map(str, roots))} | {len(settler)} files waiting | Logging to: {jobs.log_dir}")
+
+    try:
+        while not stop():
+            for path in watcher.poll(timeout=0.5):
+                if path not in active and batch.file_kind(path) is not None:
+                    settler.touch(path)
+
+            # Backpressure: settled files wait in the settler while the queue is full
+            room = max_queue - jobs.queued()
+            if room > 0:
+                for path, st in settler.pop_ready(room):
+                    kind = batch.file_kind(path)
+                    row = manifest.get(str(path)) if manifest is not None else None
+                    if path in active or batch.already_done(kind, path, st.st_size, st.st_mtime_ns, row, retry_failed):
+                        continue
+                    active.add(path)
+                    jobs.add((kind, path, st.st_size, st.st_mtime_ns))
+
+            for result in jobs.wait(timeout=0):
+                active.discard(Path(result["path"]))
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    finally:
+        watcher.close()
+
+    dropped = jobs.drop_queued()
+    print(f"\nStopping: waiting for {len(jobs.running)} running jobs ({len(dropped)} queued dropped)...")
+    try:
+        while jobs.running:
+            for result in jobs.wait():
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    except KeyboardInterrupt:
+        kill_workers()
+        jobs.close()
+        raise
+    jobs.close()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Watch folders and shrink every video and image that lands in them.")
+    ap.add_argument("dirs", nargs="+", help="Directories to watch (recursively)")
+    ap.add_argument("--threads", type=int, default=4, help="FFmpeg threads per video job (default: 4)")
+    ap.add_argument("--jobs", type=int, help="CPU budget shared by all jobs (default: usable cores)")
+    ap.add_argument("--settle", type=float, default=SETTLE_S, help=f"Seconds a file must be unmodified before it is queued (default: {SETTLE_S:g})")
+    ap.add_argument("--poll", type=float, default=POLL_S, help=f"Re-scan interval without inotify (default: {POLL_S:g})")
+    ap.add_argument("--max-queue", type=int, help="Jobs allowed to wait for a worker (default: 2 x --jobs)")
+    ap.add_argument("--retry-failed", action="store_true", help="Also retry inputs that failed in an earlier run")
+    ap.add_argument("--manifest", default=str(batch.MANIFEST_PATH), help=f"Manifest database (default: {batch.MANIFEST_PATH})")
+    args = ap.parse_args()
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            raise KeyboardInterrupt
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    manifest = Manifest(args.manifest)
+    start = time.perf_counter()
+    try:
+        results = watch(
+            args.dirs, threads=args.threads, cores=args.jobs, settle=args.settle,
+            poll_interval=args.poll, max_queue=args.max_queue, manifest=manifest,
+            retry_failed=args.retry_failed, on_result=batch.print_result, stop=lambda: stopping,
+        )
+    except KeyboardInterrupt:
+        print("Interrupted again; running jobs aborted.")
+        sys.exit(130)
+    finally:
+        manifest.close()
+    batch.print_summary(results, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()